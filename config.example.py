@@ -43,17 +43,24 @@ hold_time_deviation: float = 0.01
 # bark 异常推送
 bark_url = "https://api.day.app/aaaaaaaaaaaaa/这里改成你自己的推送内容"
 
-assert len(accounts) >= 2, "至少需要两个账户"
-assert len(symbols) >= 1, "至少需要一个交易对"
-assert max_concurrent_tasks <= int(len(accounts) / 2) * len(symbols), "最大并发任务数量不能超过 账户数量/2 * 交易对数量"
-assert depth_position > 0, "depth_position 必须大于 0"
-assert depth_position <= 500, "depth_position 必须小于等于 500"
-assert target_amount >= 10, "target_amount 必须大于等于 10"
-assert leverage is int and leverage >= 1, "leverage 必须是一个大于等于 1 的整数"
+RushEngineInterval = 1 # 引擎运行检查间隔，单位秒, 如果要高频刷，需要调低这个值
 
+# 启动时(账户初始化, 设置杠杆)同时进行的最大HTTP请求数量
+max_http_concurrency: int = 10
 
-RushEngineInterval = 1 # 引擎运行检查间隔，单位秒, 如果要高频刷，需要调低这个值
 
-if RushEngineInterval < 0.01:
-    warnings.warn("如果 RushEngineInterval 小于 0.01, 主循环会非常频繁, 占用CPU资源，可能导致交易任务无法执行。")
-    
+def validate_config():
+    """
+    校验配置, 程序启动时调用一次
+    """
+    assert len(accounts) >= 2, "至少需要两个账户"
+    assert len(symbols) >= 1, "至少需要一个交易对"
+    assert max_concurrent_tasks <= int(len(accounts) / 2) * len(symbols), "最大并发任务数量不能超过 账户数量/2 * 交易对数量"
+    assert depth_position > 0, "depth_position 必须大于 0"
+    assert depth_position <= 500, "depth_position 必须小于等于 500"
+    assert target_amount >= 10, "target_amount 必须大于等于 10"
+    assert isinstance(leverage, int) and leverage >= 1, "leverage 必须是一个大于等于 1 的整数"
+    assert max_http_concurrency >= 1, "max_http_concurrency 必须大于等于 1"
+
+    if RushEngineInterval < 0.01:
+        warnings.warn("如果 RushEngineInterval 小于 0.01, 主循环会非常频繁, 占用CPU资源，可能导致交易任务无法执行。")
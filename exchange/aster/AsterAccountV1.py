@@ -1,8 +1,22 @@
+import hashlib
+import hmac
+from pydantic import PrivateAttr
 from lib.Account import Account
 
+# Aster 表单请求公共 headers
+FORM_HEADERS = {"Content-Type": "application/x-www-form-urlencoded", "User-Agent": "PythonApp/1.0"}
+
 class AsterAccountV1(Account):
     """
     Aster账户数据类
     """
     api_key: str
     api_secret: str
+    # 预先完成密钥初始化的 HMAC-SHA256 对象, 签名时 copy 一份使用, 避免每次请求都重新处理密钥
+    _hmac_template: hmac.HMAC = PrivateAttr(default=None)
+    # 带 apiKey 的请求 headers, 每个账户固定不变, 所有请求直接复用
+    _signed_headers: dict[str, str] = PrivateAttr(default=None)
+
+    def model_post_init(self, __context) -> None:
+        self._hmac_template = hmac.new(self.api_secret.encode("utf-8"), b"", hashlib.sha256)
+        self._signed_headers = {**FORM_HEADERS, "X-MBX-APIKEY": self.api_key}
@@ -1,3 +1,6 @@
+from eth_abi import encode
+from eth_keys.datatypes import PrivateKey
+from pydantic import PrivateAttr
 from lib.Account import Account
 
 class AsterAccountV3(Account):
@@ -9,4 +12,12 @@ class AsterAccountV3(Account):
     """
     user: str
     signer: str
-    private_key: str
\ No newline at end of file
+    private_key: str
+    # user, signer 的 abi 编码结果, 每个账户固定不变, 签名时直接拼接使用
+    _address_head: bytes = PrivateAttr(default=b"")
+    # 解析好的API钱包私钥, 避免每次签名都重新解析私钥
+    _signing_key: PrivateKey = PrivateAttr(default=None)
+
+    def model_post_init(self, __context) -> None:
+        self._address_head = encode(["address", "address"], [self.user, self.signer])
+        self._signing_key = PrivateKey(bytes.fromhex(self.private_key.removeprefix("0x")))
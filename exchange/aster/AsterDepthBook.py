@@ -0,0 +1,141 @@
+import asyncio
+import orjson
+import websockets
+from websockets.exceptions import ConnectionClosed
+from pydantic import BaseModel, ConfigDict, PrivateAttr
+from lib.logger import get_logger
+from lib.tools import now
+from model.PositionPrice import PositionPrice
+
+
+logger = get_logger(__name__)
+
+# 订阅的盘口档位数量
+DEPTH_LEVELS = 20
+# 本地盘口超过该时间未收到推送视为过期, 单位毫秒
+DEPTH_STALE_TIME = 1000
+# 断线重连的最短和最长等待时间, 单位秒, 连续失败时等待时间翻倍
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 30
+
+
+class AsterDepthBook(BaseModel):
+    """
+    Aster 本地盘口数据类
+    通过 WebSocket 订阅 <symbol>@depth20@100ms 有限档深度推送
+    每条推送都是完整的前20档盘口, 直接覆盖本地盘口, 不需要做增量同步
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    # 订阅的交易对
+    symbols: list[str]
+    # ip代理
+    proxy: str | None = None
+    ws: websockets.connect = None
+    # symbol -> (asks, bids, 成交时间, 本地接收时间)
+    _books: dict[str, tuple[list[list[str]], list[list[str]], int, int]] = PrivateAttr(default_factory=dict)
+    # 盘口订阅任务
+    _run_task: asyncio.Task | None = PrivateAttr(default=None)
+    # 是否已经关闭, 关闭后不再重连
+    _closed: bool = PrivateAttr(default=False)
+
+    def start(self) -> None:
+        """
+        启动盘口订阅任务, 已经启动时不重复启动
+        """
+        if self._run_task is None:
+            self._run_task = asyncio.create_task(self.run())
+
+    async def run(self):
+        """
+        连接 WebSocket 并持续更新本地盘口
+        连接断开后按退避时间自动重连, 直到调用 close
+        """
+        streams = "/".join(f"{symbol.lower()}@depth{DEPTH_LEVELS}@100ms" for symbol in self.symbols)
+        uri = f"wss://fstream.asterdex.com/stream?streams={streams}"
+        delay = RECONNECT_MIN_DELAY
+        while not self._closed:
+            try:
+                self.ws = await websockets.connect(uri, proxy=self.proxy)
+                # 连接成功后重置退避时间
+                delay = RECONNECT_MIN_DELAY
+                async for message in self.ws:
+                    data: dict = orjson.loads(message).get("data")
+                    if data is None:
+                        continue
+                    # 记录本地接收时间判断盘口是否过期, 冷门交易对的成交时间可能长时间不变, 且交易所时间和本地时钟可能有偏差
+                    self._books[data["s"]] = (data["a"], data["b"], data["T"], now())
+
+            except ConnectionClosed:
+                pass
+            except Exception as e:
+                # 本地盘口只是加速, 出错时不终止程序, 查询价格回退到 HTTP 接口
+                logger.error(f"盘口 WebSocket错误: {e}")
+            finally:
+                # 连接断开后清空本地盘口, 重连前查询价格回退到 HTTP 接口
+                self.ws = None
+                self._books.clear()
+            if self._closed:
+                break
+            logger.info(f"盘口 WebSocket 连接断开, {delay} 秒后重连")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def close(self):
+        """
+        关闭 WebSocket 连接, 并停止重连
+        """
+        self._closed = True
+        if self.ws is not None:
+            try:
+                await self.ws.close()
+            except ConnectionClosed:
+                pass
+        if self._run_task is not None:
+            self._run_task.cancel()
+            self._run_task = None
+
+    def position_price(self, *, symbol: str, position: int) -> PositionPrice | None:
+        """
+        从本地盘口获取指定位置价格
+        :param symbol: 交易对
+        :param position: 位置
+        :return: 价格, 本地盘口不可用(未订阅/档位不足/数据过期)时返回 None
+        """
+        book = self._books.get(symbol)
+        if book is None:
+            return None
+        asks, bids, timestamp, received_at = book
+        if position > len(asks) or position > len(bids):
+            return None
+        if now() - received_at > DEPTH_STALE_TIME:
+            return None
+        return PositionPrice(ask_price=asks[position - 1][0], bid_price=bids[position - 1][0], timestamp=timestamp)
+
+
+# 共享的本地盘口 proxy -> 盘口, 盘口是公共数据, 使用同一个代理的账户共用一个订阅
+_depth_books: dict[str | None, AsterDepthBook] = {}
+
+
+def get_depth_book(*, symbols: list[str], proxy: str | None = None) -> AsterDepthBook:
+    """
+    获取共享的本地盘口, 不存在时创建并启动订阅
+    :param symbols: 订阅的交易对
+    :param proxy: ip代理
+    :return: 本地盘口
+    """
+    depth_book = _depth_books.get(proxy)
+    if depth_book is None:
+        depth_book = _depth_books[proxy] = AsterDepthBook(symbols=symbols, proxy=proxy)
+        depth_book.start()
+    return depth_book
+
+
+async def close_depth_books():
+    """
+    关闭所有共享的本地盘口, 程序退出时调用
+    """
+    for depth_book in _depth_books.values():
+        await depth_book.close()
+    _depth_books.clear()
@@ -1,68 +1,194 @@
+import functools
 from lib.tools import now
-from model.Symbol import Symbol
 from lib.Exchange import Exchange
 from model.OrderParams import OrderParams
-from httpx import AsyncClient
+from httpx import AsyncClient, Limits, Timeout
 from exchange.aster.AsterAccountV3 import AsterAccountV3
-from exchange.aster.AsterAccountV1 import AsterAccountV1
-import json
-from eth_abi import encode
-from web3 import Web3
-from eth_account.messages import encode_defunct
-from eth_account import Account
-import hmac
-import hashlib
+from exchange.aster.AsterAccountV1 import AsterAccountV1, FORM_HEADERS
+import orjson
+from eth_hash.auto import keccak
 import config
 import random
+import asyncio
+import bisect
+import time
 from urllib.parse import urlencode
 from model.PositionPrice import PositionPrice
 
 
-# 定义所有元素取值转换为字符串
-def _trim_dict(my_dict):
-    # 假设待删除的字典为d
-    for key in my_dict:
-        value = my_dict[key]
-        if isinstance(value, list):
-            new_value = []
-            for item in value:
-                if isinstance(item, dict):
-                    new_value.append(json.dumps(_trim_dict(item)))
-                else:
-                    new_value.append(str(item))
-            my_dict[key] = json.dumps(new_value)
-            continue
-        if isinstance(value, dict):
-            my_dict[key] = json.dumps(_trim_dict(value))
-            continue
-    my_dict[key] = str(value)
-    return my_dict
-
-
-def sign_v3(*, params: OrderParams, account: AsterAccountV3) -> str:
+def _stringify_params(params_dict: dict) -> bytes:
+    """
+    生成签名使用的下单参数字符串
+    所有取值转换为字符串, 按key的ASCII排序, 不含空格
+    :param params_dict: 下单参数
+    :return: 下单参数字符串 utf-8 编码
+    """
+    return orjson.dumps({key: str(value) for key, value in params_dict.items()}, option=orjson.OPT_SORT_KEYS)
+
+
+# abi 编码 (string, address, address, uint256) 时 string 是动态类型, 头部存放的是数据偏移量, 即头部4个槽位的长度
+_ABI_STRING_OFFSET = (4 * 32).to_bytes(32, "big")
+# EIP-191 签名消息头, 待签名消息固定为32字节的 keccak 摘要
+_EIP191_HEADER = b"\x19Ethereum Signed Message:\n32"
+
+
+def _encode_sign_payload(*, json_bytes: bytes, account: AsterAccountV3, nonce: int) -> bytes:
+    """
+    按 abi 编码 (json_str, user, signer, nonce)
+    结果等同于 encode(["string", "address", "address", "uint256"], [json_str, account.user, account.signer, nonce])
+    user, signer 部分使用账户上预先编码好的结果
+    :param json_bytes: 下单参数字符串 utf-8 编码
+    :param account: 账户
+    :param nonce: nonce
+    :return: 编码结果
+    """
+    return b"".join(
+        (
+            _ABI_STRING_OFFSET,
+            account._address_head,
+            nonce.to_bytes(32, "big"),
+            len(json_bytes).to_bytes(32, "big"),
+            json_bytes,
+            # 补齐到32字节的整数倍
+            b"\x00" * (-len(json_bytes) % 32),
+        )
+    )
+
+
+def sign_v3(*, params_dict: dict, nonce: int, account: AsterAccountV3) -> str:
     """
     签名
-    :param params: 下单参数
+    :param params_dict: 下单参数, 即 params.model_dump(mode="json", exclude_none=True) 的结果, 由调用方序列化后复用
+    :param nonce: nonce, 即 timestamp * 1000
     :param account: 账户
     :return: 签名
     """
-    params_dict = params.model_dump(mode="json")
-    _trim_dict(params_dict)
-    # 根据ASCII排序生成字符串并移除特殊字符
-    json_str = json.dumps(params_dict, sort_keys=True).replace(" ", "").replace("'", '"')
+    json_bytes = _stringify_params(params_dict)
 
     # 使用WEB3 ABI对生成的字符串和accuser, signer, nonce进行编码
-    encoded = encode(["string", "address", "address", "uint256"], [json_str, account.user, account.signer, params.timestamp * 1000])
-    # keccak hex
-    keccak_hex = Web3.keccak(encoded).hex()
-    signable_msg = encode_defunct(hexstr=keccak_hex)
-    signed_message = Account.sign_message(signable_message=signable_msg, private_key=account.private_key)
-    signature = "0x" + signed_message.signature.hex()
+    encoded = _encode_sign_payload(json_bytes=json_bytes, account=account, nonce=nonce)
+    # keccak 摘要, 直接作为待签名消息
+    keccak_bytes = keccak(encoded)
+    # 按 EIP-191 拼接消息头后再次 keccak, 使用账户上解析好的私钥签名
+    msg_hash = keccak(_EIP191_HEADER + keccak_bytes)
+    signed = account._signing_key.sign_msg_hash(msg_hash)
+    # r(32) + s(32) + v(1), v 按以太坊签名消息规范加 27
+    signature = "0x" + (signed.to_bytes()[:64] + bytes((signed.v + 27,))).hex()
     return signature
 
 
+def sign_v1(*, data: bytes, account: AsterAccountV1) -> str:
+    """
+    V1 HMAC-SHA256 签名
+    :param data: 待签名的请求参数
+    :param account: 账户
+    :return: 签名
+    """
+    # 复制预先初始化好密钥的 HMAC 对象, 只需要对请求参数做摘要
+    hmac_obj = account._hmac_template.copy()
+    hmac_obj.update(data)
+    return hmac_obj.hexdigest()
+
+
 base_url: str = "https://fapi.asterdex.com"
 
+# 深度接口可选的档位数量
+_DEPTH_LIMITS = (5, 10, 20, 50, 100, 500, 1000)
+# 深度缓存有效期, 单位秒
+DEPTH_CACHE_TTL = 0.2
+# 深度缓存 (symbol, limit) -> (过期时间, 深度数据)
+_depth_cache: dict[tuple[str, int], tuple[float, dict]] = {}
+# 正在请求中的深度 (symbol, limit) -> 请求任务, 同时到达的请求共用同一个结果
+_depth_inflight: dict[tuple[str, int], asyncio.Task] = {}
+
+
+async def _request_depth(*, client: AsyncClient, symbol: str, limit: int) -> dict:
+    """
+    请求深度数据并写入缓存
+    :param client: HTTP客户端
+    :param symbol: 交易对
+    :param limit: 档位数量
+    :return: 深度数据
+    """
+    response = await client.get(f"/fapi/v1/depth?symbol={symbol}&limit={limit}")
+    data: dict = response.json()
+    _depth_cache[(symbol, limit)] = (time.monotonic() + DEPTH_CACHE_TTL, data)
+    return data
+
+
+def _discard_depth_inflight(key: tuple[str, int], task: asyncio.Task) -> None:
+    """
+    请求完成后移除正在请求中的记录
+    :param key: (symbol, limit)
+    :param task: 已完成的请求任务
+    """
+    if _depth_inflight.get(key) is task:
+        del _depth_inflight[key]
+
+
+async def get_depth(*, client: AsyncClient, symbol: str, limit: int) -> dict:
+    """
+    获取深度数据
+    缓存有效期内直接返回缓存, 否则合并到正在进行的请求上, 多个账户同时查询同一交易对时只发出一次请求
+    :param client: HTTP客户端
+    :param symbol: 交易对
+    :param limit: 档位数量
+    :return: 深度数据
+    """
+    key = (symbol, limit)
+    cached = _depth_cache.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    task = _depth_inflight.get(key)
+    if task is None:
+        task = _depth_inflight[key] = asyncio.create_task(_request_depth(client=client, symbol=symbol, limit=limit))
+        # 在写入映射之后注册移除回调, eager task 同步完成时也不会留下已完成的任务
+        task.add_done_callback(functools.partial(_discard_depth_inflight, key))
+    # shield: 单个调用方被取消时不影响其他等待同一请求的调用方
+    return await asyncio.shield(task)
+
+
+# 共享的HTTP客户端 proxy -> client, 使用同一个代理的账户共用连接池和 TLS 会话
+_clients: dict[str | None, AsyncClient] = {}
+
+
+def get_client(*, proxy: str | None = None) -> AsyncClient:
+    """
+    获取共享的HTTP客户端, 不存在时创建
+    鉴权信息在每个请求的 headers 中传递, 所以不同账户可以共用同一个客户端
+    :param proxy: ip代理
+    :return: HTTP客户端
+    """
+    client = _clients.get(proxy)
+    if client is None:
+        client = _clients[proxy] = create_client(proxy=proxy)
+    return client
+
+
+async def close_clients():
+    """
+    关闭所有共享的HTTP客户端, 程序退出时调用
+    """
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+
+
+def create_client(*, proxy: str | None = None) -> AsyncClient:
+    """
+    创建HTTP客户端
+    开启 HTTP/2, 并发请求复用同一个 TLS 连接, 同时调高连接池上限, 避免突发下单/撤单请求排队
+    :param proxy: ip代理
+    :return: HTTP客户端
+    """
+    return AsyncClient(
+        http2=True,
+        proxy=proxy,
+        base_url=base_url,
+        limits=Limits(max_connections=256, max_keepalive_connections=64, keepalive_expiry=90),
+        timeout=Timeout(5.0, connect=2.0),
+    )
+
 
 class AsterExchange(Exchange):
     """
@@ -81,14 +207,25 @@ class AsterExchange(Exchange):
         return response.json()
 
     @staticmethod
-    def sign_v3(*, params: OrderParams, account: AsterAccountV3) -> str:
+    def sign_v3(*, params_dict: dict, nonce: int, account: AsterAccountV3) -> str:
         """
         签名
-        :param params: 下单参数
+        :param params_dict: 下单参数
+        :param nonce: nonce
         :param account: 账户
         :return: 签名
         """
-        return sign_v3(params=params, account=account)
+        return sign_v3(params_dict=params_dict, nonce=nonce, account=account)
+
+    @staticmethod
+    def sign_v1(*, data: bytes, account: AsterAccountV1) -> str:
+        """
+        签名
+        :param data: 待签名的请求参数
+        :param account: 账户
+        :return: 签名
+        """
+        return sign_v1(data=data, account=account)
 
     @staticmethod
     async def order_v3(*, client: AsyncClient, params: OrderParams, account: AsterAccountV3) -> dict:
@@ -100,14 +237,15 @@ class AsterExchange(Exchange):
         :return: 下单结果
         POST /fapi/v3/order
         """
-        params_dict = params.model_dump(mode="json")
-        params_dict["signature"] = AsterExchange.sign_v3(params=params, account=account)
-        params_dict["nonce"] = params.timestamp * 1000
+        params_dict = params.model_dump(mode="json", exclude_none=True)
+        nonce = params.timestamp * 1000
+        # 签名复用同一份序列化结果, 签名完成后再追加其他字段
+        params_dict["signature"] = AsterExchange.sign_v3(params_dict=params_dict, nonce=nonce, account=account)
+        params_dict["nonce"] = nonce
         # params_dict["recvWindow"] = 50000
         params_dict["user"] = account.user
         params_dict["signer"] = account.signer
-        headers = {"Content-Type": "application/x-www-form-urlencoded", "User-Agent": "PythonApp/1.0"}
-        response = await client.post("/fapi/v3/order", data=params_dict, headers=headers)
+        response = await client.post("/fapi/v3/order", data=params_dict, headers=FORM_HEADERS)
         # url = "https://fapi.asterdex.com/fapi/v3/order"
         # res = requests.post(url, data=params_dict, headers=headers, proxies=dict(
         #     http="socks5://127.0.0.1:1080",
@@ -127,23 +265,41 @@ class AsterExchange(Exchange):
         POST /fapi/v1/order
         """
         params_dict = params.model_dump(mode="json", exclude_none=True)
-        data = urlencode(params_dict)
-        hmac_obj = hmac.new(account.api_secret.encode("utf-8"), data.encode("utf-8"), hashlib.sha256)
-        data += f"&signature={hmac_obj.hexdigest()}"
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "User-Agent": "PythonApp/1.0",
-            "X-MBX-APIKEY": account.api_key,
-        }
+        # 直接对 urlencode 后的字节签名, 拼接后作为请求体发送, 不再经过 httpx 表单编码
+        data = urlencode(params_dict).encode("ascii")
+        body = data + b"&signature=" + AsterExchange.sign_v1(data=data, account=account).encode("ascii")
         url = "/fapi/v1/order"
         if config.simulate:
             url = "/fapi/v1/order/test"
-        response = await client.post(url, data=data, headers=headers)
+        response = await client.post(url, content=body, headers=account._signed_headers)
         result = response.json()
         if config.simulate:
             result["orderId"] = int(random.random() * 1000000)
         return result
 
+    @staticmethod
+    async def batch_order_v1(*, client: AsyncClient, params_list: list[OrderParams], account: AsterAccountV1) -> list[dict] | dict:
+        """
+        批量下单
+        :param client: HTTP客户端
+        :param params_list: 下单参数列表, 最多5个
+        :param account: 账户
+        :return: 下单结果列表, 与下单参数一一对应; 整批失败时返回错误信息
+        POST /fapi/v1/batchOrders
+        """
+        if config.simulate:
+            # 批量下单没有测试接口, 模拟模式逐个调用测试下单接口
+            return list(await asyncio.gather(*(AsterExchange.order_v1(client=client, params=params, account=account) for params in params_list)))
+        batch_orders = [params.model_dump(mode="json", exclude_none=True, exclude={"timestamp"}) for params in params_list]
+        params_dict = {
+            "batchOrders": orjson.dumps(batch_orders).decode(),
+            "timestamp": now(),
+        }
+        data = urlencode(params_dict).encode("ascii")
+        body = data + b"&signature=" + AsterExchange.sign_v1(data=data, account=account).encode("ascii")
+        response = await client.post("/fapi/v1/batchOrders", content=body, headers=account._signed_headers)
+        return response.json()
+
     @staticmethod
     async def get_depth_position(*, client: AsyncClient, symbol: str, position: int) -> PositionPrice:
         """
@@ -153,15 +309,10 @@ class AsterExchange(Exchange):
         :param position: 位置
         :return: 价格距离盘口的位置(ask_price, bid_price)
         """
-        limits = [5, 10, 20, 50, 100, 500, 1000]
-        limit = 50
-        for _limit in limits:
-            if position < _limit:
-                limit = _limit
-                break
-
-        response = await client.get(f"/fapi/v1/depth?symbol={symbol}&limit={limit}")
-        data: dict = response.json()
+        # 取第一个大于 position 的可选档位数量, 超出范围时取最大档位
+        limit = _DEPTH_LIMITS[min(bisect.bisect_right(_DEPTH_LIMITS, position), len(_DEPTH_LIMITS) - 1)]
+
+        data = await get_depth(client=client, symbol=symbol, limit=limit)
         asks: list[list[str]] = data.get("asks")
         bids: list[list[str]] = data.get("bids")
         ask_price = asks[position - 1][0]
@@ -169,7 +320,7 @@ class AsterExchange(Exchange):
         return PositionPrice(ask_price=ask_price, bid_price=bid_price, timestamp=data.get("T"))
 
     @staticmethod
-    async def delete_order_v1(*, client: AsyncClient, order_id: int, symbol: str, account: AsterAccountV1) -> dict:
+    async def delete_order_v1(*, client: AsyncClient, order_id: int | str, symbol: str, account: AsterAccountV1) -> dict:
         """
         取消订单
         :param client: HTTP客户端
@@ -184,14 +335,8 @@ class AsterExchange(Exchange):
             "timestamp": now(),
         }
         data = urlencode(params_dict)
-        hmac_obj = hmac.new(account.api_secret.encode("utf-8"), data.encode("utf-8"), hashlib.sha256)
-        data += f"&signature={hmac_obj.hexdigest()}"
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "User-Agent": "PythonApp/1.0",
-            "X-MBX-APIKEY": account.api_key,
-        }
-        response = await client.delete(f"/fapi/v1/order?{data}", headers=headers)
+        data += f"&signature={AsterExchange.sign_v1(data=data.encode('ascii'), account=account)}"
+        response = await client.delete(f"/fapi/v1/order?{data}", headers=account._signed_headers)
         return response.json()
 
     @staticmethod
@@ -208,14 +353,8 @@ class AsterExchange(Exchange):
             "timestamp": now()
         }
         data = urlencode(params_dict)
-        hmac_obj = hmac.new(account.api_secret.encode("utf-8"), data.encode("utf-8"), hashlib.sha256)
-        data += f"&signature={hmac_obj.hexdigest()}"
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "User-Agent": "PythonApp/1.0",
-            "X-MBX-APIKEY": account.api_key,
-        }
-        response = await client.delete(f"/fapi/v1/allOpenOrders?{data}", headers=headers)
+        data += f"&signature={AsterExchange.sign_v1(data=data.encode('ascii'), account=account)}"
+        response = await client.delete(f"/fapi/v1/allOpenOrders?{data}", headers=account._signed_headers)
         return response.json()
 
     @staticmethod
@@ -234,14 +373,8 @@ class AsterExchange(Exchange):
             "timestamp": now(),
         }
         data = urlencode(params_dict)
-        hmac_obj = hmac.new(account.api_secret.encode("utf-8"), data.encode("utf-8"), hashlib.sha256)
-        data += f"&signature={hmac_obj.hexdigest()}"
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "User-Agent": "PythonApp/1.0",
-            "X-MBX-APIKEY": account.api_key,
-        }
-        response = await client.post(f"/fapi/v1/leverage?{data}", headers=headers)
+        data += f"&signature={AsterExchange.sign_v1(data=data.encode('ascii'), account=account)}"
+        response = await client.post(f"/fapi/v1/leverage?{data}", headers=account._signed_headers)
         return response.json()
 
     @staticmethod
@@ -257,14 +390,8 @@ class AsterExchange(Exchange):
             "timestamp": now(),
         }
         data = urlencode(params_dict)
-        hmac_obj = hmac.new(account.api_secret.encode("utf-8"), data.encode("utf-8"), hashlib.sha256)
-        data += f"&signature={hmac_obj.hexdigest()}"
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "User-Agent": "PythonApp/1.0",
-            "X-MBX-APIKEY": account.api_key,
-        }
-        response = await client.get(f"/fapi/v4/account?{data}", headers=headers)
+        data += f"&signature={AsterExchange.sign_v1(data=data.encode('ascii'), account=account)}"
+        response = await client.get(f"/fapi/v4/account?{data}", headers=account._signed_headers)
         return response.json()
 
     @staticmethod
@@ -276,12 +403,7 @@ class AsterExchange(Exchange):
         :return: 创建监听键结果
         POST /fapi/v1/listenKey
         """
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "User-Agent": "PythonApp/1.0",
-            "X-MBX-APIKEY": account.api_key,
-        }
-        response = await client.post(f"/fapi/v1/listenKey", headers=headers)
+        response = await client.post(f"/fapi/v1/listenKey", headers=account._signed_headers)
         return response.json()
 
     @staticmethod
@@ -293,12 +415,7 @@ class AsterExchange(Exchange):
         :return: 刷新监听键结果
         POST /fapi/v1/listenKey
         """
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "User-Agent": "PythonApp/1.0",
-            "X-MBX-APIKEY": account.api_key,
-        }
-        await client.put(f"/fapi/v1/listenKey", headers=headers)
+        await client.put(f"/fapi/v1/listenKey", headers=account._signed_headers)
 
     @staticmethod
     async def all_open_orders_v1(*, client: AsyncClient, account: AsterAccountV1) -> dict:
@@ -314,12 +431,6 @@ class AsterExchange(Exchange):
             "timestamp": now(),
         }
         data = urlencode(params_dict)
-        hmac_obj = hmac.new(account.api_secret.encode("utf-8"), data.encode("utf-8"), hashlib.sha256)
-        data += f"&signature={hmac_obj.hexdigest()}"
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "User-Agent": "PythonApp/1.0",
-            "X-MBX-APIKEY": account.api_key,
-        }
-        response = await client.get(f"/fapi/v1/openOrders?{data}", headers=headers)
+        data += f"&signature={AsterExchange.sign_v1(data=data.encode('ascii'), account=account)}"
+        response = await client.get(f"/fapi/v1/openOrders?{data}", headers=account._signed_headers)
         return response.json()
@@ -1,11 +1,12 @@
 from random import random
+import sys
 import config
 from exchange.aster.AsterAccountV1 import AsterAccountV1
-from exchange.aster.AsterExchange import AsterExchange, base_url
-from httpx import AsyncClient
+from exchange.aster.AsterExchange import AsterExchange, get_client
+from exchange.aster.AsterDepthBook import AsterDepthBook, get_depth_book
 from lib.logger import get_logger
 from model.Symbol import Symbol
-from model.OrderParams import OrderParams, OrderSide, OrderTimeInForce, OrderType
+from model.OrderParams import OrderParams, OrderSide, OrderType
 from lib.tools import format_to_stepsize, now
 from model.Order import Order, OrderHoldType
 from model.CanceledOrder import CanceledOrder
@@ -13,12 +14,29 @@ from model.PositionPrice import PositionPrice
 import websockets
 from websockets.exceptions import ConnectionClosed
 from lib.ExchangeAccount import ExchangeAccount
+from lib.RateLimiter import AsyncTokenBucket
 from typing import Callable
+from pydantic import PrivateAttr
 import asyncio
 
 
 logger = get_logger(__name__)
 
+# 每个账户每秒允许的请求数量
+REQUEST_RATE = 20
+# 每个账户允许的突发请求数量
+REQUEST_BURST = 40
+# 批量下单每批最多合并的订单数量
+ORDER_BATCH_SIZE = 5
+# 批量下单合并的时间窗口, 单位秒
+ORDER_BATCH_WINDOW = 0.005
+# listenKey 刷新间隔, 单位秒
+LISTEN_KEY_REFRESH_INTERVAL = 60 * 30
+# listenKey 刷新随机抖动, 单位秒, 避免多个账户同时刷新
+LISTEN_KEY_REFRESH_JITTER = 60
+# listenKey 刷新失败后的重试间隔, 单位秒
+LISTEN_KEY_RETRY_INTERVAL = 30
+
 
 class AsterExchangeAccountV1(ExchangeAccount):
     """
@@ -28,32 +46,64 @@ class AsterExchangeAccountV1(ExchangeAccount):
     account: AsterAccountV1 = None
     exchange_info: dict = None
     ws: websockets.connect = None
+    # 请求限流器
+    limiter: AsyncTokenBucket = None
+    # 本地盘口
+    depth_book: AsterDepthBook = None
+    # 待合并的下单请求队列 (下单参数, 下单结果Future)
+    _order_queue: asyncio.Queue = PrivateAttr(default_factory=asyncio.Queue)
+    # 合并下单任务
+    _order_batch_task: asyncio.Task = PrivateAttr(default=None)
+    # 正在发送的批量下单任务, 保留引用避免被垃圾回收, 关闭账户时等待完成
+    _dispatch_tasks: set[asyncio.Task] = PrivateAttr(default_factory=set)
+    # 账户是否已经关闭, 关闭后不再接受下单请求
+    _closed: bool = PrivateAttr(default=False)
+    # listenKey 刷新定时器
+    _refresh_handle: asyncio.TimerHandle = PrivateAttr(default=None)
+    # 正在执行的 listenKey 刷新任务
+    _refresh_task: asyncio.Task = PrivateAttr(default=None)
 
     async def init(self, *, account: AsterAccountV1, callback: Callable[[str], None]) -> asyncio.Task:
         """
         初始化交易所账户
         """
         self.account = account
-        if self.account.proxy is not None:
-            self.client = AsyncClient(proxy=self.account.proxy, base_url=base_url)
-        else:
-            self.client = AsyncClient(base_url=base_url)
+        self.client = get_client(proxy=self.account.proxy)
+        self.limiter = AsyncTokenBucket(rate=REQUEST_RATE, burst=REQUEST_BURST)
 
         await self.init_exchange_info()
         listen_key = await self.get_listen_key()
-        # 刷新 listenKey 任务
-        refresh_task = asyncio.create_task(self.refresh_listen_key())
+        # 定时刷新 listenKey
+        self.schedule_refresh_listen_key()
         # 初始化 WebSocket 连接
         ws_task = asyncio.create_task(self.init_ws(listen_key=listen_key, callback=callback))
+        # 合并下单任务
+        self._order_batch_task = asyncio.create_task(self.order_batch_worker())
+        # 订阅盘口深度, 同一代理的账户共用一个订阅
+        self.depth_book = get_depth_book(symbols=config.symbols, proxy=self.account.proxy)
         await self.cancel_all_open_orders()
         await self.clear_all_positions()
-        return asyncio.gather(refresh_task, ws_task, return_exceptions=True)
+        return asyncio.gather(ws_task, self._order_batch_task, return_exceptions=True)
 
     async def close(self):
         """
         关闭交易所账户
         """
-        await self.client.aclose()
+        self._closed = True
+        if self._order_batch_task is not None:
+            self._order_batch_task.cancel()
+        # 队列中还没发送的下单请求直接失败, 避免调用方一直等待
+        error = ConnectionError(f"账户 {self.account.id} 已关闭")
+        while not self._order_queue.empty():
+            self._fail_orders(batch=[self._order_queue.get_nowait()], error=error)
+        # 已经发出的下单请求等待交易所返回结果
+        if len(self._dispatch_tasks) > 0:
+            await asyncio.gather(*self._dispatch_tasks, return_exceptions=True)
+        if self._refresh_handle is not None:
+            self._refresh_handle.cancel()
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        # HTTP客户端和本地盘口是共享的, 由 close_clients 和 close_depth_books 在程序退出时统一关闭
         if self.ws is not None:
             try:
                 await self.ws.close()
@@ -72,15 +122,12 @@ class AsterExchangeAccountV1(ExchangeAccount):
         生成交易对列表
         """
         for symbol_info in self.exchange_info["symbols"]:
-            symbol = symbol_info["symbol"]
-            filters = symbol_info["filters"]
-            tick_size: str = None
-            step_size: str = None
-            for filter in filters:
-                if filter["filterType"] == "PRICE_FILTER":
-                    tick_size = filter["tickSize"]
-                if filter["filterType"] == "LOT_SIZE":
-                    step_size = filter["stepSize"]
+            # 驻留交易对字符串, 和配置中的交易对是同一个对象时, 字典查找直接按身份比较
+            symbol = sys.intern(symbol_info["symbol"])
+            # filterType -> filter
+            filters = {symbol_filter["filterType"]: symbol_filter for symbol_filter in symbol_info["filters"]}
+            tick_size: str = filters.get("PRICE_FILTER", {}).get("tickSize")
+            step_size: str = filters.get("LOT_SIZE", {}).get("stepSize")
             self.symbols[symbol] = Symbol(symbol=symbol, tick_size=tick_size, step_size=step_size)
 
     async def order(self, *, params: OrderParams, hold_type: OrderHoldType, price_time: int) -> Order:
@@ -90,6 +137,8 @@ class AsterExchangeAccountV1(ExchangeAccount):
         if params.quantity is None:
             if params.price is None:
                 raise ValueError("price is None")
+            symbol = self.symbols[params.symbol]
+            price = float(params.price)
             target_amount = self.account.target_amount
             # 偏移目标金额
             deviation_amount = target_amount * self.account.amount_deviation * (random() * 2 - 1)
@@ -97,25 +146,149 @@ class AsterExchangeAccountV1(ExchangeAccount):
             target_amount += deviation_amount
             # if config.simulate:
             #     self.symbols[params.symbol].step_size = "0.0001"
-            if (target_amount / float(params.price)) < float(self.symbols[params.symbol].step_size):
-                min_usdt = float(self.symbols[params.symbol].step_size) * float(params.price)
-                raise ValueError(f"下单金额 {target_amount} 小于{params.symbol}步进金额(最小下单金额) {self.symbols[params.symbol].step_size} {params.symbol} 约 {min_usdt} USDT")
+            quantity = target_amount / price
+            if quantity < symbol.step_size_f:
+                min_usdt = symbol.step_size_f * price
+                raise ValueError(f"下单金额 {target_amount} 小于{params.symbol}步进金额(最小下单金额) {symbol.step_size} {params.symbol} 约 {min_usdt} USDT")
             # 实际下单数量
-            params.quantity = format_to_stepsize(target_amount / float(params.price), self.symbols[params.symbol].step_size)
+            params.quantity = symbol.format_quantity(quantity)
 
         # logger.info(f"下单参数: {params.model_dump_json(indent=2, exclude_none=True)}")
 
-        order_result = await AsterExchange.order_v1(client=self.client, params=params, account=self.account)
+        order_result = await self.submit_order(params=params)
         if order_result.get("code") is not None:
             raise ValueError(f"下单失败: {order_result}")
-        order = Order(order_params=params, order_result=order_result, hold_type=hold_type, price_time=price_time, account_id=self.account.id)
+        order = Order.new_trusted(order_params=params, order_result=order_result, hold_type=hold_type, price_time=price_time, account_id=self.account.id)
         return order
 
+    async def submit_order(self, *, params: OrderParams) -> dict:
+        """
+        提交下单请求
+        同一时间窗口内的下单请求会被合并成一次批量下单
+        :param params: 下单参数
+        :return: 下单结果
+        """
+        if self._closed:
+            raise ConnectionError(f"账户 {self.account.id} 已关闭")
+        future = asyncio.get_running_loop().create_future()
+        self._order_queue.put_nowait((params, future))
+        return await future
+
+    async def order_batch_worker(self):
+        """
+        合并下单任务
+        从下单队列中取出同一时间窗口内的下单请求, 合并后批量下单
+        取出第一个请求后队列已空时直接下单, 单个订单(如市价第二腿)不等待合并窗口
+        """
+        loop = asyncio.get_running_loop()
+        queue = self._order_queue
+        while not self._closed:
+            batch = [await queue.get()]
+            if queue.empty():
+                self._start_dispatch(batch=batch)
+                continue
+            deadline = loop.time() + ORDER_BATCH_WINDOW
+            try:
+                while len(batch) < ORDER_BATCH_SIZE:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), timeout=timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # 合并期间任务被取消(账户关闭), 已经取出的请求直接失败
+                self._fail_orders(batch=batch, error=ConnectionError(f"账户 {self.account.id} 已关闭"))
+                raise
+            # 不等待本批下单完成, 继续合并下一批
+            self._start_dispatch(batch=batch)
+
+    @staticmethod
+    def _fail_orders(*, batch: list[tuple[OrderParams, asyncio.Future]], error: BaseException) -> None:
+        """
+        将一批下单请求设置为失败
+        :param batch: 下单请求列表 (下单参数, 下单结果Future)
+        :param error: 异常
+        """
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def _start_dispatch(self, *, batch: list[tuple[OrderParams, asyncio.Future]]) -> None:
+        """
+        启动批量下单任务, 并保留任务引用直到完成
+        :param batch: 下单请求列表 (下单参数, 下单结果Future)
+        """
+        # wait_for 在结果已就绪时可能吞掉取消, 合并任务被取消后仍会走到这里, 账户已关闭时直接失败
+        if self._closed:
+            self._fail_orders(batch=batch, error=ConnectionError(f"账户 {self.account.id} 已关闭"))
+            return
+        task = asyncio.create_task(self.dispatch_order_batch(batch=batch))
+        self._dispatch_tasks.add(task)
+        task.add_done_callback(self._dispatch_tasks.discard)
+
+    async def dispatch_order_batch(self, *, batch: list[tuple[OrderParams, asyncio.Future]]):
+        """
+        发送一批下单请求, 并将结果分发给对应的下单请求
+        :param batch: 下单请求列表 (下单参数, 下单结果Future)
+        """
+        try:
+            async with self.limiter:
+                # 调用方可能在排队期间被取消(如 TaskGroup 取消另一腿), 这些订单不再发送
+                batch = [(params, future) for params, future in batch if not future.cancelled()]
+                if len(batch) == 0:
+                    return
+                if len(batch) == 1:
+                    results = [await AsterExchange.order_v1(client=self.client, params=batch[0][0], account=self.account)]
+                else:
+                    results = await AsterExchange.batch_order_v1(client=self.client, params_list=[params for params, _ in batch], account=self.account)
+                # 整批下单失败, 每个订单都返回同样的错误信息
+                if not isinstance(results, list):
+                    results = [results] * len(batch)
+        except Exception as e:
+            self._fail_orders(batch=batch, error=e)
+            return
+        except asyncio.CancelledError:
+            # 发送任务被取消时也要让调用方结束等待
+            self._fail_orders(batch=batch, error=ConnectionError(f"账户 {self.account.id} 下单请求被取消"))
+            raise
+        orphans: list[tuple[OrderParams, dict]] = []
+        for (params, future), result in zip(batch, results):
+            if future.cancelled():
+                # 请求发出后调用方被取消, 订单已经到达交易所但没有任务跟踪
+                orphans.append((params, result))
+            elif not future.done():
+                future.set_result(result)
+        for params, result in orphans:
+            await self.cancel_orphan_order(params=params, result=result)
+
+    async def cancel_orphan_order(self, *, params: OrderParams, result: dict):
+        """
+        取消调用方已经取消, 但仍然下单成功的订单
+        :param params: 下单参数
+        :param result: 下单结果
+        """
+        order_id = result.get("orderId")
+        if order_id is None:
+            return
+        logger.error(f"账户 {self.account.id} 订单 {order_id} 下单后调用方已取消, 撤销该订单: {result}")
+        try:
+            async with self.limiter:
+                cancel_result = await AsterExchange.delete_order_v1(client=self.client, account=self.account, symbol=params.symbol, order_id=order_id)
+        except Exception as e:
+            logger.error(f"账户 {self.account.id} 撤销订单 {order_id} 失败: {e}")
+            return
+        # 市价单等已经成交的订单无法撤销, 留下的持仓由本轮结束时的清仓处理
+        if cancel_result.get("code") is not None:
+            logger.error(f"账户 {self.account.id} 撤销订单 {order_id} 失败: {cancel_result}")
+
     async def cancel(self, *, order: Order) -> CanceledOrder:
         """
         取消订单
         """
-        cancel_result = await AsterExchange.delete_order_v1(client=self.client, account=self.account, symbol=order.order_params.symbol, order_id=order.order_result["orderId"])
+        async with self.limiter:
+            cancel_result = await AsterExchange.delete_order_v1(client=self.client, account=self.account, symbol=order.order_params.symbol, order_id=order.order_id)
         # 模拟模式 不抛出取消订单异常
         # 捕获到异常, 终止程序: 取消订单失败: {'code': -2011, 'msg': 'Unknown order sent.'}
         # 忽略未知订单异常
@@ -129,7 +302,8 @@ class AsterExchangeAccountV1(ExchangeAccount):
         :return: 获取所有未成交订单结果
         """
         logger.info(f"账户 {self.account.id} 获取所有未成交订单")
-        open_orders = await AsterExchange.all_open_orders_v1(client=self.client, account=self.account)
+        async with self.limiter:
+            open_orders = await AsterExchange.all_open_orders_v1(client=self.client, account=self.account)
         if not isinstance(open_orders, list):
             raise ValueError(f"账户 {self.account.id} 获取所有未成交订单失败: {open_orders}")
         return open_orders
@@ -140,7 +314,7 @@ class AsterExchangeAccountV1(ExchangeAccount):
         :return: 所有未成交订单交易对集合
         """
         open_orders = await self.get_all_open_orders()
-        return set(map(lambda order: order["symbol"], open_orders))
+        return {order["symbol"] for order in open_orders}
 
     async def cancel_all_open_orders(self) -> dict:
         """
@@ -148,11 +322,13 @@ class AsterExchangeAccountV1(ExchangeAccount):
         :return: 取消所有未成交订单结果
         """
         logger.info(f"账户 {self.account.id} 取消所有未成交订单")
-        symbol_set = await self.get_all_open_orders_symbol_set()
-        cancel_result = {}
-        for symbol in symbol_set:
-            cancel_result[symbol] = await self.cancel_all(symbol=symbol)
-        return cancel_result
+        symbol_list = list(await self.get_all_open_orders_symbol_set())
+        # 各交易对并发取消, 全部完成后再抛出其中的异常
+        results = await asyncio.gather(*(self.cancel_all(symbol=symbol) for symbol in symbol_list), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return dict(zip(symbol_list, results))
 
     async def cancel_all(self, *, symbol: str) -> dict:
         """
@@ -193,33 +369,72 @@ class AsterExchangeAccountV1(ExchangeAccount):
         """
         account_info = await self.get_account_info()
         positions = account_info.get("positions", [])
+        order_tasks = []
         for position in positions:
             position_amount = float(position["positionAmt"])
+            # 跳过空仓
+            if position_amount == 0:
+                continue
+            symbol = self.symbols[position["symbol"]]
             params = OrderParams(
-                symbol=position["symbol"],
+                symbol=symbol.symbol,
                 type=OrderType.MARKET,
                 side=OrderSide.SELL if position_amount > 0 else OrderSide.BUY,
-                quantity=str(position["positionAmt"]).replace("-", ""),
+                quantity=format_to_stepsize(abs(position_amount), symbol.step_size),
                 timestamp=now(),
             )
             logger.info(f"账户 {self.account.id} 清仓下单参数: {params.model_dump_json(indent=2, exclude_none=True)}")
-            await self.order(params=params, hold_type=OrderHoldType.close, price_time=now())
+            order_tasks.append(self.order(params=params, hold_type=OrderHoldType.close, price_time=now()))
+        # 各持仓并发清仓, 全部完成后再抛出其中的异常
+        results = await asyncio.gather(*order_tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
 
     async def get_depth_position(self, *, symbol: str, position: int) -> PositionPrice:
         """
         获取盘口指定位置价格
+        优先使用 WebSocket 维护的本地盘口, 本地盘口不可用时使用 HTTP 接口
         :param symbol: 交易对
         :return: ask_price, bid_price
         """
-        return await AsterExchange.get_depth_position(client=self.client, symbol=symbol, position=position)
+        if self.depth_book is not None:
+            position_price = self.depth_book.position_price(symbol=symbol, position=position)
+            if position_price is not None:
+                return position_price
+        async with self.limiter:
+            return await AsterExchange.get_depth_position(client=self.client, symbol=symbol, position=position)
+
+    def schedule_refresh_listen_key(self, *, delay: float | None = None):
+        """
+        注册下一次刷新 listenKey 的定时器
+        :param delay: 延迟秒数, 默认为刷新间隔加随机抖动
+        """
+        if delay is None:
+            delay = LISTEN_KEY_REFRESH_INTERVAL + random() * LISTEN_KEY_REFRESH_JITTER
+        loop = asyncio.get_running_loop()
+        self._refresh_handle = loop.call_later(delay, self._start_refresh_listen_key)
+
+    def _start_refresh_listen_key(self):
+        """
+        定时器回调, 启动刷新任务
+        """
+        self._refresh_handle = None
+        self._refresh_task = asyncio.create_task(self.refresh_listen_key())
 
     async def refresh_listen_key(self):
         """
-        刷新监听键
+        刷新监听键, 完成后注册下一次刷新
         """
-        while True:
-            await asyncio.sleep(60 * 30)
+        try:
             await AsterExchange.refresh_listen_key_v1(client=self.client, account=self.account)
+        except Exception as e:
+            logger.error(f"账户 {self.account.id} 刷新listenKey失败: {e}")
+            self.schedule_refresh_listen_key(delay=LISTEN_KEY_RETRY_INTERVAL)
+        else:
+            self.schedule_refresh_listen_key()
+        finally:
+            self._refresh_task = None
 
     async def get_listen_key(self) -> str:
         """
@@ -238,6 +453,7 @@ class AsterExchangeAccountV1(ExchangeAccount):
             # 建立连接并将实例保存到self.ws
             self.ws = await websockets.connect(uri, proxy=self.account.proxy)
             self.ready = True
+            self.ready_event.set()
             # 持续监听消息
             async for message in self.ws:
                 callback(message=message)  # 调用回调处理消息
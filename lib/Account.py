@@ -1,4 +1,3 @@
-import uuid
 from pydantic import BaseModel
 import config
 
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from model.Symbol import Symbol
+from model.PositionPrice import PositionPrice
 from pydantic import BaseModel
 from httpx import AsyncClient
 
@@ -10,6 +10,14 @@ class Exchange(BaseModel, ABC):
     交易所数据类
     """
 
+    @staticmethod
     @abstractmethod
-    async def get_depth_position(self, *, client: AsyncClient, symbol: str, position: int) -> (str, str):
+    async def get_depth_position(*, client: AsyncClient, symbol: str, position: int) -> PositionPrice:
+        """
+        获取盘口指定位置价格
+        :param client: 共享的HTTP客户端 (HTTP/2 连接池), 由调用方传入, 不要在单次请求中创建
+        :param symbol: 交易对
+        :param position: 位置
+        :return: PositionPrice
+        """
         pass
\ No newline at end of file
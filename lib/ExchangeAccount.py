@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from pydantic import BaseModel, ConfigDict
+import asyncio
+from pydantic import BaseModel, ConfigDict, Field
 from lib.Account import Account
 from model.PositionPrice import PositionPrice
 from model.Order import Order, OrderHoldType
@@ -24,6 +25,8 @@ class ExchangeAccount(BaseModel, ABC):
     symbols: dict[str, Symbol] = {}
     # 账户是否初始化就绪
     ready: bool = False
+    # 账户初始化就绪事件, 与 ready 同时设置
+    ready_event: asyncio.Event = Field(default_factory=asyncio.Event, exclude=True)
 
     @abstractmethod
     async def get_depth_position(self, *, symbol: str, position: int) -> PositionPrice:
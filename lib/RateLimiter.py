@@ -0,0 +1,70 @@
+import asyncio
+import time
+from pydantic import BaseModel, PrivateAttr
+
+
+class AsyncTokenBucket(BaseModel):
+    """
+    异步令牌桶限流器
+    每秒补充 rate 个令牌, 最多积攒 burst 个令牌, 每个请求消耗一个令牌
+    令牌不足时等待补充, 避免请求被交易所以 429/418 拒绝
+    使用方式: async with limiter: ...
+    """
+
+    # 每秒补充的令牌数量
+    rate: float
+    # 令牌桶容量, 即允许的突发请求数量
+    burst: int
+    # 当前令牌数量
+    _tokens: float = PrivateAttr(default=0)
+    # 上次补充令牌的时间
+    _updated_at: float = PrivateAttr(default=0)
+    _condition: asyncio.Condition = PrivateAttr(default_factory=asyncio.Condition)
+
+    def model_post_init(self, __context) -> None:
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        """
+        按流逝的时间补充令牌
+        """
+        current = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (current - self._updated_at) * self.rate)
+        self._updated_at = current
+
+    async def acquire(self) -> None:
+        """
+        获取一个令牌, 令牌不足时等待
+        """
+        async with self._condition:
+            self._refill()
+            while self._tokens < 1:
+                try:
+                    await asyncio.wait_for(self._condition.wait(), timeout=(1 - self._tokens) / self.rate)
+                except asyncio.TimeoutError:
+                    pass
+                self._refill()
+            self._tokens -= 1
+
+    async def set_rate(self, *, rate: float, burst: int | None = None) -> None:
+        """
+        运行时调整限流速率, 例如收到 429 后收紧速率
+        :param rate: 每秒补充的令牌数量
+        :param burst: 令牌桶容量, 不传则保持不变
+        """
+        async with self._condition:
+            self._refill()
+            self.rate = rate
+            if burst is not None:
+                self.burst = burst
+                self._tokens = min(self._tokens, burst)
+            # 唤醒等待中的请求, 按新的速率重新计算等待时间
+            self._condition.notify_all()
+
+    async def __aenter__(self) -> "AsyncTokenBucket":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        return None
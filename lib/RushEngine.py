@@ -1,7 +1,6 @@
 import functools
-import json
-from httpx import get
-from pydantic import BaseModel
+import orjson
+from pydantic import BaseModel, PrivateAttr, TypeAdapter
 from exchange.aster.AsterExchangeAccountV1 import AsterExchangeAccountV1
 from lib.ExchangeAccount import ExchangeAccount
 from lib.RushTask import RushTask, RushTaskStatus
@@ -22,6 +21,11 @@ exchange_map = {
     "aster": AsterAccountV1,
 }
 
+# 保存任务时使用的序列化器, 只构建一次
+_task_list_adapter = TypeAdapter(list[RushTask])
+# 保存任务时排除账户对象
+_TASK_SAVE_EXCLUDE = {"__all__": {"first_account", "second_account"}}
+
 
 class RushEngine(BaseModel):
     """
@@ -34,26 +38,37 @@ class RushEngine(BaseModel):
     failed_tasks: list[RushTask] = []
     # account_id -> task_id -> task
     account_running_tasks: dict[str, dict[str, RushTask]] = {}
+    # account_id -> 正在运行任务的交易对
+    account_busy_symbols: dict[str, set[str]] = {}
+    # symbol -> 支持该交易对的账户ID列表, 账户初始化完成后生成
+    symbol_accounts: dict[str, list[str]] = {}
 
     max_concurrent_tasks: int = config.max_concurrent_tasks
+    # 有任务结束(完成或失败)时设置, 唤醒任务运行器
+    _wake: asyncio.Event = PrivateAttr(default_factory=asyncio.Event)
+    # 停止事件, 收到终止信号时设置, 可以由 start 传入与外层共享
+    _stop_event: asyncio.Event = PrivateAttr(default_factory=asyncio.Event)
+    # 引擎独立的随机数生成器
+    _rng: random.Random = PrivateAttr(default_factory=random.Random)
 
     async def simulate_callback(self):
         """
         模拟回调函数
         """
         while True:
-            for _, task in self.running_tasks.items():
+            # 回调中可能以 eager task 的方式同步执行任务代码, 遍历前先取快照
+            for task in tuple(self.running_tasks.values()):
                 if len(task.open_orders) == 0:
                     continue
-                target_order_id = random.choice(list(task.open_orders.keys()))
+                target_order_id = self._rng.choice(tuple(task.open_orders))
                 target_order = task.open_orders[target_order_id]
                 data = {
                     "e": "ORDER_TRADE_UPDATE",
                     "E": now(),
                     "T": now(),
-                    "o": {"x": "FILLED", "X": "FILLED", "i": target_order.order_result["orderId"]},
+                    "o": {"x": "FILLED", "X": "FILLED", "i": target_order_id},
                 }
-                self.callback(account_id=target_order.account_id, message=json.dumps(data))
+                self._deliver(account_id=target_order.account_id, data=data)
 
             await asyncio.sleep(5)
 
@@ -61,10 +76,20 @@ class RushEngine(BaseModel):
         """
         账户回调函数
         """
-        logger.info(f"账户 [{account_id}] 回调消息：{message}")
-        if account_id in self.account_running_tasks:
-            for _, task in self.account_running_tasks[account_id].items():
-                data = json.loads(message)
+        if self.account_running_tasks.get(account_id):
+            # 同一条消息只解析一次, 分发给该账户的所有任务
+            self._deliver(account_id=account_id, data=orjson.loads(message))
+
+    def _deliver(self, *, account_id: str, data: dict):
+        """
+        将解析后的消息分发给账户正在运行的任务
+        :param account_id: 账户ID
+        :param data: 消息内容
+        """
+        account_tasks = self.account_running_tasks.get(account_id)
+        if account_tasks:
+            # 任务回调可能同步修改账户任务映射, 遍历快照
+            for task in tuple(account_tasks.values()):
                 task.order_update_callback(message=data)
 
     def generate_available_account_symbols(self) -> dict[str, list[str]]:
@@ -75,23 +100,18 @@ class RushEngine(BaseModel):
             dict[str, list[str]]: 交易对的可用账户列表 symbol -> account_id列表
         """
         result: dict[str, list[str]] = {}
+        symbol_accounts = self.symbol_accounts
+        account_busy_symbols = self.account_busy_symbols
         for symbol in config.symbols:
-            result[symbol] = []
-            for account_id, account in self.accounts.items():
-                # 检查账户是否支持该交易对
-                if symbol in account.symbols:
-                    _account_running_tasks = self.account_running_tasks.get(account_id)
-                    if _account_running_tasks is None:
-                        result[symbol].append(account_id)
-                    else:
-                        # 该账户正在运行的任务中 是否存在相同symbol的任务
-                        any_task_running = any(task.symbol == symbol for _, task in _account_running_tasks.items())
-                        # 如果不存在 则该账户可以执行 该交易对的任务
-                        if not any_task_running:
-                            result[symbol].append(account_id)
-            # 如果该交易对 没有足够的可用账户 则移除该交易对
-            if len(result[symbol]) < 2:
-                result.pop(symbol)
+            # 支持该交易对的账户中, 没有正在运行相同交易对任务的账户
+            account_ids = [
+                account_id
+                for account_id in symbol_accounts.get(symbol, ())
+                if symbol not in account_busy_symbols.get(account_id, ())
+            ]
+            # 如果该交易对 没有足够的可用账户 则跳过该交易对
+            if len(account_ids) >= 2:
+                result[symbol] = account_ids
 
         return result
 
@@ -102,15 +122,12 @@ class RushEngine(BaseModel):
         available_account_symbols = self.generate_available_account_symbols()
         if len(available_account_symbols) == 0:
             return None
-        picked_symbol = random.choice(list(available_account_symbols.keys()))
+        picked_symbol = self._rng.choice(tuple(available_account_symbols))
         available_account_ids = available_account_symbols[picked_symbol]
         if len(available_account_ids) < 2:
             return None
-        first_account_id = random.choice(available_account_ids)
-        available_account_ids.remove(first_account_id)
-        second_account_id = random.choice(available_account_ids)
-        if first_account_id == second_account_id:
-            return None
+        # 不放回抽取两个账户, 保证两个账户不同
+        first_account_id, second_account_id = self._rng.sample(available_account_ids, 2)
 
         return RushTask(
             id=f"RT-{picked_symbol}-{uuid.uuid4().hex}",
@@ -119,82 +136,119 @@ class RushEngine(BaseModel):
             second_account=self.accounts[second_account_id],
         )
 
+    def release_task(self, *, task_id: str, task: RushTask):
+        """
+        从账户运行任务中移除已结束的任务
+        :param task_id: 任务ID
+        :param task: 任务
+        """
+        for account_id in (task.first_account_id, task.second_account_id):
+            account_tasks = self.account_running_tasks.get(account_id)
+            if account_tasks is not None:
+                account_tasks.pop(task_id, None)
+            busy_symbols = self.account_busy_symbols.get(account_id)
+            if busy_symbols is not None:
+                busy_symbols.discard(task.symbol)
+
     def remove_finished_tasks(self):
         """
         移除已完成的任务
         """
-        remove_task_ids: list[str] = []
+        running_tasks: dict[str, RushTask] = {}
+        failed_message: str | None = None
         for task_id, task in self.running_tasks.items():
-            first_account_id = task.first_account.account.id
-            second_account_id = task.second_account.account.id
-            if task.status == RushTaskStatus.COMPLETED:
-                remove_task_ids.append(task_id)
+            status = task.status
+            if status is RushTaskStatus.COMPLETED:
                 self.completed_tasks.append(task)
-                # 从账户运行任务中移除
-                for account_id in [first_account_id, second_account_id]:
-                    if account_id in self.account_running_tasks:
-                        self.account_running_tasks[account_id].pop(task_id)
-            elif task.status == RushTaskStatus.FAILED:
-                remove_task_ids.append(task_id)
+                self.release_task(task_id=task_id, task=task)
+            elif status is RushTaskStatus.FAILED:
                 self.failed_tasks.append(task)
-                # 从账户运行任务中移除
-                for account_id in [first_account_id, second_account_id]:
-                    if account_id in self.account_running_tasks:
-                        self.account_running_tasks[account_id].pop(task_id)
-                # 终止程序，通知用户需要手动检查账号是否有未完成的订单
-                logger.error(f"任务 {task_id} 失败，账户 {first_account_id} 和 {second_account_id} 可能有未完成的订单")
-                raise ValueError(f"任务 {task_id} 失败，账户 {first_account_id} 和 {second_account_id} 可能有未完成的订单")
-
-        # 移除已完成的任务
-        for task_id in remove_task_ids:
-            self.running_tasks.pop(task_id)
+                self.release_task(task_id=task_id, task=task)
+                if failed_message is None:
+                    failed_message = f"任务 {task_id} 失败，账户 {task.first_account_id} 和 {task.second_account_id} 可能有未完成的订单"
+            else:
+                running_tasks[task_id] = task
+        # 只保留仍在运行的任务
+        self.running_tasks = running_tasks
+
+        if failed_message is not None:
+            # 终止程序，通知用户需要手动检查账号是否有未完成的订单
+            logger.error(failed_message)
+            raise ValueError(failed_message)
 
     async def task_runner(self, *, times=100):
         """
         任务运行器
         """
-        while not self.check_stop() and len(self.completed_tasks) + len(self.failed_tasks) < times:
+        # 循环中反复使用的属性和方法绑定为局部变量
+        # running_tasks 每轮会被 remove_finished_tasks 重新赋值, 不能绑定
+        wake = self._wake
+        completed_tasks = self.completed_tasks
+        failed_tasks = self.failed_tasks
+        account_running_tasks = self.account_running_tasks
+        account_busy_symbols = self.account_busy_symbols
+        max_concurrent_tasks = self.max_concurrent_tasks
+        interval = config.RushEngineInterval
+        check_stop = self.check_stop
+        remove_finished_tasks = self.remove_finished_tasks
+        generate_next_task = self.generate_next_task
+        while not check_stop() and len(completed_tasks) + len(failed_tasks) < times:
+            # 先清除唤醒标示再检查任务, 检查期间结束的任务会在下一次等待时立即唤醒
+            wake.clear()
             # 1. 移除已完成的任务
-            self.remove_finished_tasks()
+            remove_finished_tasks()
 
             # 2. 如果还有任务且未达到最大并发，创建新任务
-            while len(self.running_tasks) < self.max_concurrent_tasks:
-                task = self.generate_next_task()
+            while len(self.running_tasks) < max_concurrent_tasks:
+                task = generate_next_task()
                 if task is None:
                     break
-                self.running_tasks[task.id] = task
-                first_account_id = task.first_account.account.id
-                second_account_id = task.second_account.account.id
-                for account_id in [first_account_id, second_account_id]:
-                    if account_id not in self.account_running_tasks:
-                        self.account_running_tasks[account_id] = {}
-                    self.account_running_tasks[account_id][task.id] = task
+                task_id = task.id
+                symbol = task.symbol
+                self.running_tasks[task_id] = task
+                for account_id in (task.first_account_id, task.second_account_id):
+                    account_running_tasks.setdefault(account_id, {})[task_id] = task
+                    account_busy_symbols.setdefault(account_id, set()).add(symbol)
                 # 启动任务加入间隔，避免同时启动所有任务
                 await asyncio.sleep(1)
                 # 启动任务
+                task.set_finished_callback(callback=wake.set)
                 asyncio.create_task(task.run())
 
             # 3. 如果完成的任务大于20条，保存一次
             # 不需要这里保存了，等一次引擎循环结束后自动保存
             # if len(self.completed_tasks) + len(self.failed_tasks) >= 20:
-            #     self.save_tasks()
+            #     await self.save_tasks()
 
-            # 4. 短暂休眠，避免空循环占用CPU
-            await asyncio.sleep(config.RushEngineInterval)
+            # 4. 启动任务期间已有任务结束, 直接进入下一轮回收和启动
+            if wake.is_set():
+                continue
+            # 等待任务结束唤醒, 超时后重新检查停止标示
+            try:
+                await asyncio.wait_for(wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
 
         logger.info("安全退出，等待所有任务完成")
         # 标记所有运行中的任务为停止
         for task in self.running_tasks.values():
             task.stop = True
-        while len(self.running_tasks) > 0:
+        while True:
+            self._wake.clear()
             self.remove_finished_tasks()
-            await asyncio.sleep(1)
+            if len(self.running_tasks) == 0:
+                break
             if self.check_error():
                 logger.error("发现错误强制退出标示，跳出等待任务完成，直接开始清理工作")
                 break
+            # 等待任务结束, 超时后重新检查错误标示
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
 
         # 5. 结束保存任务
-        self.save_tasks()
+        await self.save_tasks()
         # 6. 清理账户订单，持仓
         await self.clear_all()
         # 7. 关闭所有账户连接
@@ -228,15 +282,38 @@ class RushEngine(BaseModel):
         """
         检查是否需要停止引擎
         """
-        return os.path.exists("shutdown")
+        return self._stop_event.is_set()
 
-    async def start(self, *, times=100):
+    def request_stop(self):
+        """
+        请求停止引擎, 不再启动新任务, 等待运行中的任务完成后退出
+        终止信号由 main 统一注册, 收到信号时调用
+        """
+        self._stop_event.set()
+        # 唤醒任务运行器立即退出等待
+        self._wake.set()
+
+    async def start(self, *, times=100, stop_event: asyncio.Event | None = None):
         """
         启动交易引擎
+        :param times: 本轮执行的任务次数
+        :param stop_event: 外层共享的停止事件, 设置后不再启动新任务
         """
+        if stop_event is not None:
+            self._stop_event = stop_event
+        # Python 3.12+ 使用 eager task, 新任务在 create_task 时立即执行到第一个真正的 await, 省去一次事件循环调度
+        if hasattr(asyncio, "eager_task_factory"):
+            asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
         # 启动账户任务
         logger.info(f"Rush Engine 启动!")
         account_tasks: list[asyncio.Task] = []
+        # 初始化和设置杠杆时限制同时进行的HTTP请求数量, 避免触发交易所限流
+        semaphore = asyncio.Semaphore(getattr(config, "max_http_concurrency", 10))
+
+        async def bounded(coro):
+            async with semaphore:
+                return await coro
+
         for account_dict in config.accounts:
             accountClass = exchange_map[account_dict["exchange"]]
             if account_dict.get("id") is None:
@@ -245,12 +322,11 @@ class RushEngine(BaseModel):
             if isinstance(account, AsterAccountV1):
                 exchangeAccount = AsterExchangeAccountV1()
                 self.accounts[account.id] = exchangeAccount
-                account_tasks.append(asyncio.create_task(exchangeAccount.init(account=account, callback=functools.partial(self.callback, account_id=account.id))))
+                account_tasks.append(asyncio.create_task(bounded(exchangeAccount.init(account=account, callback=functools.partial(self.callback, account_id=account.id)))))
 
         logger.info(f"开始初始化 {len(self.accounts)} 个账户")
         # 等待账户初始化完成
-        while any(not account.ready for account in self.accounts.values()):
-            await asyncio.sleep(0.1)
+        await asyncio.gather(*(account.ready_event.wait() for account in self.accounts.values()))
 
         logger.info(f"账户初始化完成 共初始化 {len(self.accounts)} 个账户, 开始设置杠杆。")
 
@@ -258,36 +334,49 @@ class RushEngine(BaseModel):
         leverage_tasks = []
         for account in self.accounts.values():
             for symbol in config.symbols:
-                leverage_tasks.append(asyncio.create_task(account.set_leverage(symbol=symbol, leverage=config.leverage)))
+                leverage_tasks.append(bounded(account.set_leverage(symbol=symbol, leverage=config.leverage)))
 
         # 等待所有杠杆设置完成
         await asyncio.gather(*leverage_tasks, return_exceptions=True)
+        # 账户支持的交易对在运行期间不变, 预先生成 symbol -> 账户ID列表
+        self.symbol_accounts = {
+            symbol: [account_id for account_id, account in self.accounts.items() if symbol in account.symbols]
+            for symbol in config.symbols
+        }
         logger.info(f"杠杆设置完成 启动交易")
 
         # 启动任务运行器
         await self.task_runner(times=times)
 
-    def save_tasks(self):
+    async def save_tasks(self):
         """
         保存执行完成的RushTask
+        序列化和写文件在线程中执行, 避免阻塞事件循环
         """
         if config.simulate:
             logger.info("模拟模式，不保存任务")
             return
         file_name_map = {0: "completed_tasks", 1: "failed_tasks"}
-        exclude = {
-            "first_account",
-            "second_account",
-        }
         folder = os.path.join("data", "tasks")
         if not os.path.exists(folder):
             os.makedirs(folder)
         for index, task_list in enumerate([self.completed_tasks, self.failed_tasks]):
             if len(task_list) == 0:
                 continue
+            tasks = task_list.copy()
+            task_list.clear()
             save_time = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
             file_name = file_name_map[index] + "_" + save_time + ".json"
-            with open(os.path.join(folder, file_name), "w") as f:
-                json.dump([task.model_dump(exclude=exclude) for task in task_list], f, indent=2)
-                logger.info(f"已保存 {len(task_list)} 条 {file_name_map[index]}")
-            task_list.clear()
+            await asyncio.to_thread(self.write_tasks, path=os.path.join(folder, file_name), tasks=tasks)
+            logger.info(f"已保存 {len(tasks)} 条 {file_name_map[index]}")
+
+    @staticmethod
+    def write_tasks(*, path: str, tasks: list[RushTask]):
+        """
+        序列化任务并写入文件
+        :param path: 文件路径
+        :param tasks: 任务列表
+        """
+        data = _task_list_adapter.dump_json(tasks, exclude=_TASK_SAVE_EXCLUDE, indent=2)
+        with open(path, "wb") as f:
+            f.write(data)
@@ -1,9 +1,10 @@
 import asyncio
+from collections import deque
 from enum import Enum
 import json
-from unittest import result
 import uuid
-from pydantic import BaseModel, ConfigDict
+from typing import Callable
+from pydantic import BaseModel, ConfigDict, PrivateAttr, computed_field
 from lib.ExchangeAccount import ExchangeAccount
 from lib.tools import now
 from model.PositionPrice import PositionPrice
@@ -16,6 +17,11 @@ from lib.logger import get_logger
 
 logger = get_logger(__name__)
 
+# 需要处理的订单终态
+_TERMINAL_STATUSES = frozenset(("FILLED", "EXPIRED"))
+# 单个任务最多保留的日志条数
+LOG_ENTRIES_LIMIT = 256
+
 
 class RushTaskStatus(str, Enum):
     """
@@ -55,12 +61,21 @@ class RushTaskStage(str, Enum):
     completed = "completed-任务完成-6"
 
 
+# 状态和阶段对应的文字, 生成日志时直接查表
+_STATUS_LABEL: dict[RushTaskStatus, str] = {status: status.value for status in RushTaskStatus}
+_STAGE_LABEL: dict[RushTaskStage, str] = {stage: stage.value for stage in RushTaskStage}
+# 字符串 -> 状态和阶段, str 枚举成员和对应字符串哈希相同, 传入成员或字符串都能查到, 不经过 Enum(value) 调用
+_STATUS_FROM_VALUE: dict[str, RushTaskStatus] = {status.value: status for status in RushTaskStatus}
+_STAGE_FROM_VALUE: dict[str, RushTaskStage] = {stage.value: stage for stage in RushTaskStage}
+
+
 class RushTaskLog(BaseModel):
     """
     刷量任务阶段日志类
+    日志生成后不会再修改
     """
 
-    model_config = ConfigDict(use_enum_values=True)  # Pydantic v2
+    model_config = ConfigDict(use_enum_values=True, frozen=True)  # Pydantic v2
     timestamp: int
     preview_status: RushTaskStatus
     current_status: RushTaskStatus
@@ -87,22 +102,81 @@ class RushTask(BaseModel):
     first_account: ExchangeAccount
     # 第二个账户
     second_account: ExchangeAccount
+    # 第一个, 第二个账户ID, 创建任务时从账户上取出, 避免每次都访问 account.account.id
+    first_account_id: str | None = None
+    second_account_id: str | None = None
     # 已成交订单列表
     filled_orders: list[FilledOrder] = []
     # 未成交订单映射
     open_orders: dict[str, Order] = {}
     # 已取消订单列表
     cancel_orders: list[CanceledOrder] = []
-    # 任务日志列表
-    logs: list[RushTaskLog] = []
+    stop:bool = False
     # 过期订单 id 列表，因为有可能ws先收到下单时订单过期，下单的http函数慢一步
     # 所以 下单完成后 要检查刚才的订单的订单ID是不是在这个列表中。
     # 如果存在，则直接进行处理限价单下单失败流程
-    expired_order_id_map: dict[str, dict] = {}
+    # 只在任务运行期间使用, 不需要序列化
+    _expired_order_id_map: dict[str, dict] = PrivateAttr(default_factory=dict)
     # 同理限价单下单也会存在这个问题
-    filled_order_id_map: dict[str, dict] = {}
-    
-    stop:bool = False
+    _filled_order_id_map: dict[str, dict] = PrivateAttr(default_factory=dict)
+    # 任务结束(完成或失败)时的回调
+    _on_finished: Callable[[], None] | None = PrivateAttr(default=None)
+    # 账户ID -> 账户
+    _account_by_id: dict[str, ExchangeAccount] = PrivateAttr(default_factory=dict)
+    # 待处理的订单更新消息队列
+    _update_queue: asyncio.Queue = PrivateAttr(default_factory=asyncio.Queue)
+    # 订单更新消息处理任务
+    _update_task: asyncio.Task | None = PrivateAttr(default=None)
+    # 持仓时间, 单位秒, 创建任务时按随机账户的配置生成
+    _hold_time: float = PrivateAttr(default=0)
+    # 任务日志原始数据 (timestamp, preview_status, current_status, preview_stage, current_stage)
+    # 状态变化时只记录元组, 读取 logs 时再生成 RushTaskLog 和日志内容, 最多保留 LOG_ENTRIES_LIMIT 条
+    _log_entries: deque[tuple] = PrivateAttr(default_factory=lambda: deque(maxlen=LOG_ENTRIES_LIMIT))
+    # 开仓成交的买单和卖单, 成交时记录, 平仓时直接使用
+    _open_buy_order: FilledOrder | None = PrivateAttr(default=None)
+    _open_sell_order: FilledOrder | None = PrivateAttr(default=None)
+
+    @computed_field
+    @property
+    def logs(self) -> list[RushTaskLog]:
+        """
+        任务日志列表
+        """
+        return [
+            RushTaskLog.model_construct(
+                timestamp=timestamp,
+                preview_status=preview_status,
+                current_status=current_status,
+                preview_stage=preview_stage,
+                current_stage=current_stage,
+                message=f"任务 [{self.id}] 状态从 {_STATUS_LABEL[preview_status]} 变更为 {_STATUS_LABEL[current_status]}",
+            )
+            for timestamp, preview_status, current_status, preview_stage, current_stage in self._log_entries
+        ]
+
+    def model_post_init(self, __context) -> None:
+        # use_enum_values 会把传入的状态和阶段转成字符串, 统一转回枚举, 后续直接用 is 比较
+        self.status = _STATUS_FROM_VALUE[self.status]
+        self.stage = _STAGE_FROM_VALUE[self.stage]
+        self.first_account_id = self.first_account.account.id
+        self.second_account_id = self.second_account.account.id
+        self._account_by_id = {
+            self.first_account_id: self.first_account,
+            self.second_account_id: self.second_account,
+        }
+        picked_account, _ = self.random_exchange_account()
+        account = picked_account.account
+        hold_time = account.hold_time
+        hold_time_deviation = account.hold_time_deviation
+        self._hold_time = hold_time + hold_time * (random.random() * 2 - 1) * hold_time_deviation
+
+    def set_finished_callback(self, *, callback: Callable[[], None]) -> None:
+        """
+        设置任务结束(完成或失败)时的回调
+        :param callback: 回调函数
+        :return: None
+        """
+        self._on_finished = callback
 
     def change_status(self, *, status: RushTaskStatus) -> None:
         """
@@ -110,22 +184,18 @@ class RushTask(BaseModel):
         :param status: 任务状态
         :return: None
         """
-        if self.status == status:
+        status = _STATUS_FROM_VALUE[status]
+        if self.status is status:
             return
         preview_status = self.status
-        message = f"任务 [{self.id}] 状态从 {preview_status.value} 变更为 {status.value}"
         self.status = status
-        logger.info(message)
-        self.logs.append(
-            RushTaskLog(
-                timestamp=now(),
-                preview_status=preview_status,
-                current_status=status,
-                preview_stage=self.stage,
-                current_stage=self.stage,
-                message=message,
-            )
-        )
+        logger.info("任务 [{}] 状态从 {} 变更为 {}", self.id, _STATUS_LABEL[preview_status], _STATUS_LABEL[status])
+        self._log_entries.append((now(), preview_status, status, self.stage, self.stage))
+        if status in (RushTaskStatus.COMPLETED, RushTaskStatus.FAILED):
+            if self._update_task is not None:
+                self._update_task.cancel()
+            if self._on_finished is not None:
+                self._on_finished()
 
     def change_stage(self, *, stage: RushTaskStage) -> None:
         """
@@ -133,12 +203,12 @@ class RushTask(BaseModel):
         :param stage: 任务阶段
         :return: None
         """
-        if self.stage == stage:
+        stage = _STAGE_FROM_VALUE[stage]
+        if self.stage is stage:
             return
         preview_stage = self.stage
-        message = f"任务 [{self.id}] 阶段从 {preview_stage.value} 变更为 {stage.value}"
         self.stage = stage
-        logger.info(message)
+        logger.info("任务 [{}] 阶段从 {} 变更为 {}", self.id, _STAGE_LABEL[preview_stage], _STAGE_LABEL[stage])
 
     @staticmethod
     async def create(*, symbol: str, first_account: ExchangeAccount, second_account: ExchangeAccount) -> "RushTask":
@@ -163,61 +233,84 @@ class RushTask(BaseModel):
         :param order_id: 订单ID
         :return: None
         """
-        # 将该订单移动到已取消订单列表
-        order = self.open_orders.get(order_id)
+        # 从未成交订单映射中移除该订单, 移动到已取消订单列表
+        order = self.open_orders.pop(order_id, None)
         if order is None:
-            self.expired_order_id_map[order_id] = message
+            self._expired_order_id_map[order_id] = message
             return
         self.cancel_orders.append(CanceledOrder.from_order(order=order, cancel_result=message))
-        # 从未成交订单映射中移除已取消订单
-        self.open_orders.pop(order_id)
-        account_id = order.account_id
-        account = self.first_account if account_id == self.first_account.account.id else self.second_account
+        account = self._account_by_id[order.account_id]
 
         # 获取订单参数，改成市价单
-        order_params = order.order_params.model_copy()
-        order_params.type = OrderType.MARKET
-        order_params.timeInForce = None
-        order_params.timestamp = now()
-        order_params.price = None
+        order_params = order.order_params.to_market_params(timestamp=now())
         # 重新提交订单
         new_order: Order = await account.order(params=order_params, hold_type=order.hold_type, price_time=order.price_time)
-        new_order_id = str(new_order.order_result["orderId"])
+        new_order_id = new_order.order_id
         self.open_orders[new_order_id] = new_order
         # 这里不能使用ws回调了 直接继续执行下一步 和正常限价单回调的 ws 后续操作一样
-        self.limit_order_on_filled(order=new_order, message={"message": "原限价单GTX下单失败，改为市价单直接下单"})
+        self.limit_order_on_filled(order=new_order, message={"message": "原限价单GTX下单失败，改为市价单直接下单", "result": message})
 
     def order_update_callback(self, *, message: dict):
         """
-        已成交订单回调
-        :param filled_result: 已成交订单结果
+        订单更新回调
+        由 WebSocket 读取循环同步调用, 只把消息放入队列, 由 update_worker 处理, 避免阻塞后续消息的读取
+        :param message: 订单更新消息
         :return: None
         """
-        update_order: dict = message.get("o")
-        if update_order is None:
-            return
-        current_status: str = update_order.get("X")
-        if current_status is None:
-            return
-        if current_status not in ["FILLED", "EXPIRED"]:
-            return
-        order_id: str = str(update_order.get("i"))
-        if order_id is None:
+        self._update_queue.put_nowait(message)
+
+    async def update_worker(self) -> None:
+        """
+        按顺序处理订单更新消息
+        :return: None
+        """
+        while True:
+            message = await self._update_queue.get()
+            try:
+                self.handle_order_update(message=message)
+            except Exception as e:
+                logger.error("任务 [{}] 处理订单更新失败: {}", self.id, e)
+
+    def handle_order_update(self, *, message: dict):
+        """
+        处理订单更新消息
+        :param message: 订单更新消息
+        :return: None
+        """
+        # 订单更新消息都有这些字段, 其他类型的消息直接忽略
+        try:
+            update_order: dict = message["o"]
+            current_status: str = update_order["X"]
+            if current_status not in _TERMINAL_STATUSES:
+                return
+            order_id = str(update_order["i"])
+        except KeyError:
             return
         if current_status == "EXPIRED":
-            logger.info(f"任务 [{self.id}] 订单 {order_id} 状态更新为 {current_status}, 重新下市价单")
+            logger.info("任务 [{}] 订单 {} 状态更新为 {}, 重新下市价单", self.id, order_id, current_status)
             asyncio.create_task(self.handle_failed_limit_order(order_id=order_id, message=message))
             return
         elif current_status == "FILLED":
-            self.filled_order_id_map[order_id] = message
-        if order_id not in self.open_orders.keys():
-            return
+            self._filled_order_id_map[order_id] = message
         order = self.open_orders.get(order_id)
         if order is None:
             return
 
         self.limit_order_on_filled(order=order, message=message)
 
+    def add_filled_order(self, *, filled_order: FilledOrder) -> None:
+        """
+        记录已成交订单
+        :param filled_order: 已成交订单
+        :return: None
+        """
+        self.filled_orders.append(filled_order)
+        if filled_order.hold_type is OrderHoldType.open:
+            if filled_order.order_params.side is OrderSide.BUY:
+                self._open_buy_order = filled_order
+            else:
+                self._open_sell_order = filled_order
+
     def limit_order_on_filled(self, *, order: Order, message: dict) -> None:
         """
         处理已成交限价单
@@ -225,13 +318,13 @@ class RushTask(BaseModel):
         :param message: 已成交订单结果
         :return: None
         """
-        order_id = str(order.order_result["orderId"])
-        logger.info(f"任务 [{self.id}] {order.hold_type.value} 阶段挂单成交 {order_id} 状态更新为 FILLED")
+        order_id = order.order_id
+        logger.info("任务 [{}] {} 阶段挂单成交 {} 状态更新为 FILLED", self.id, order.hold_type.value, order_id)
         filled_order = FilledOrder.from_order(filled_result=message, order=order)
-        self.filled_orders.append(filled_order)
+        self.add_filled_order(filled_order=filled_order)
         # 从未成交订单映射中移除已成交订单
-        self.open_orders.pop(order_id)
-        if order.hold_type == OrderHoldType.open:
+        self.open_orders.pop(order_id, None)
+        if order.hold_type is OrderHoldType.open:
             # 开仓限价单成交，取消另外一边的限价开仓挂单，改成市价单开仓立即成交
             self.change_stage(stage=RushTaskStage.open_market)
             asyncio.create_task(self.open_market())
@@ -247,43 +340,11 @@ class RushTask(BaseModel):
         阶段2：市价开仓
         :return: None
         """
-        # if len(self.open_orders) != 1:
-        #     raise ValueError(f"任务 [{self.id}] 开仓限价单成交后执行，将另外一边的订单改为市价单开仓立即成交，但是只有 {len(self.open_orders)} 个未成交订单")
-        # if len(self.filled_orders) != 1:
-        #     raise ValueError(f"任务 [{self.id}] 开仓限价单成交后执行，将另外一边的订单改为市价单开仓立即成交，但是只有 {len(self.filled_orders)} 个已成交订单")
-        if len(self.open_orders) == 0:
-            # 两边同时成交
-            logger.info(f"任务 [{self.id}] 开仓限价单两边同时成交")
-            # 竞争一个 进入下一阶段
-            if self.stage != RushTaskStage.hold:
-                logger.info(f"任务 [{self.id}] 开仓限价单两边同时成交, 进入下一阶段")
-                self.change_stage(stage=RushTaskStage.hold)
-                asyncio.create_task(self.hold())
-            else:
-                logger.info(f"任务 [{self.id}] 开仓限价单两边同时成交, 已经处于下一阶段，不做处理")
-            return
-
-        open_order_id = list(self.open_orders.keys())[0]
-        open_order = self.open_orders[open_order_id]
-        open_order_accounts = [account for account in [self.first_account, self.second_account] if account.account.id == open_order.account_id]
-        if len(open_order_accounts) != 1:
-            raise ValueError(f"任务 [{self.id}] 开仓限价单成交后执行，将另外一边的订单改为市价单开仓立即成交，但是找到 {len(open_order_accounts)} 个账户")
-        open_order_account = open_order_accounts[0]
-        canceled_order = await open_order_account.cancel(order=open_order)
-        self.open_orders.pop(open_order_id)
-        self.cancel_orders.append(canceled_order)
-
-        open_market_order_params = canceled_order.order_params.model_copy()
-        open_market_order_params.type = OrderType.MARKET
-        open_market_order_params.timeInForce = None
-        open_market_order_params.timestamp = now()
-        open_market_order_params.price = None
-
-        self.change_stage(stage=RushTaskStage.open_market)
-        open_market_order = await open_order_account.order(params=open_market_order_params, hold_type=OrderHoldType.open, price_time=now())
-        filled_order = FilledOrder.from_order(order=open_market_order)
-        self.filled_orders.append(filled_order)
-        asyncio.create_task(self.hold())
+        await self._market_second_leg(
+            hold_type=OrderHoldType.open,
+            next_stage=RushTaskStage.hold,
+            on_complete=self._schedule_hold,
+        )
 
     async def close_market(self) -> None:
         """
@@ -292,43 +353,58 @@ class RushTask(BaseModel):
         阶段5：市价平仓
         :return: None
         """
-        # if len(self.open_orders) != 1:
-        #     raise ValueError(f"任务 [{self.id}] 平仓限价单成交后执行，将另外一边的订单改为市价单平仓立即成交，但是只有 {len(self.open_orders)} 个未成交订单")
-        # if len(self.filled_orders) != 3:
-        #     raise ValueError(f"任务 [{self.id}] 平仓限价单成交后执行，将另外一边的订单改为市价单平仓立即成交，但是只有 {len(self.filled_orders)} 个已成交订单")
+        await self._market_second_leg(
+            hold_type=OrderHoldType.close,
+            next_stage=RushTaskStage.completed,
+            on_complete=self.finish,
+        )
+
+    def _schedule_hold(self) -> None:
+        """
+        启动持仓等待
+        :return: None
+        """
+        asyncio.create_task(self.hold())
+
+    async def _market_second_leg(self, *, hold_type: OrderHoldType, next_stage: RushTaskStage, on_complete: Callable[[], None]) -> None:
+        """
+        一边限价单成交后, 取消另外一边的限价单, 改为市价单立即成交
+        市价单阶段已经在 limit_order_on_filled 中设置
+        :param hold_type: 持仓目的类型
+        :param next_stage: 市价单成交后进入的阶段
+        :param on_complete: 市价单成交后执行
+        :return: None
+        """
+        label = "开仓" if hold_type is OrderHoldType.open else "平仓"
         if len(self.open_orders) == 0:
             # 两边同时成交
-            logger.info(f"任务 [{self.id}] 平仓限价单两边同时成交")
+            logger.info("任务 [{}] {}限价单两边同时成交", self.id, label)
             # 竞争一个 进入下一阶段
-            if self.stage != RushTaskStage.completed:
-                logger.info(f"任务 [{self.id}] 平仓限价单两边同时成交, 进入下一阶段")
-                self.change_stage(stage=RushTaskStage.completed)
-                self.finish()
+            if self.stage is not next_stage:
+                logger.info("任务 [{}] {}限价单两边同时成交, 进入下一阶段", self.id, label)
+                self.change_stage(stage=next_stage)
+                on_complete()
             else:
-                logger.info(f"任务 [{self.id}] 平仓限价单两边同时成交, 已经处于下一阶段，不做处理")
+                logger.info("任务 [{}] {}限价单两边同时成交, 已经处于下一阶段，不做处理", self.id, label)
             return
 
-        open_order_id = list(self.open_orders.keys())[0]
+        open_order_id = next(iter(self.open_orders))
         open_order = self.open_orders[open_order_id]
-        open_order_accounts = [account for account in [self.first_account, self.second_account] if account.account.id == open_order.account_id]
-        if len(open_order_accounts) != 1:
-            raise ValueError(f"任务 [{self.id}] 平仓限价单成交后执行，将另外一边的订单改为市价单平仓立即成交，但是找到 {len(open_order_accounts)} 个账户")
-        open_order_account = open_order_accounts[0]
-        canceled_order = await open_order_account.cancel(order=open_order)
+        open_order_account = self._account_by_id.get(open_order.account_id)
+        if open_order_account is None:
+            raise ValueError(f"任务 [{self.id}] {label}限价单成交后执行，将另外一边的订单改为市价单{label}立即成交，但是找不到账户 {open_order.account_id}")
+        # 先发出撤单请求, 等待撤单结果期间准备市价单参数
+        # 市价单必须在撤单完成后发送, 避免限价单在撤单前成交导致重复下单
+        cancel_task = asyncio.create_task(open_order_account.cancel(order=open_order))
+        market_order_params = open_order.order_params.to_market_params(timestamp=now())
+
+        canceled_order = await cancel_task
         self.open_orders.pop(open_order_id)
         self.cancel_orders.append(canceled_order)
-
-        close_market_order_params = canceled_order.order_params.model_copy()
-        close_market_order_params.type = OrderType.MARKET
-        close_market_order_params.timeInForce = None
-        close_market_order_params.timestamp = now()
-        close_market_order_params.price = None
-
-        self.change_stage(stage=RushTaskStage.close_market)
-        close_market_order = await open_order_account.order(params=close_market_order_params, hold_type=OrderHoldType.close, price_time=now())
-        filled_order = FilledOrder.from_order(order=close_market_order)
-        self.filled_orders.append(filled_order)
-        self.finish()
+        market_order = await open_order_account.order(params=market_order_params, hold_type=hold_type, price_time=now())
+        filled_order = FilledOrder.from_order(order=market_order)
+        self.add_filled_order(filled_order=filled_order)
+        on_complete()
 
     async def hold(self) -> None:
         """
@@ -336,18 +412,14 @@ class RushTask(BaseModel):
         阶段3：持仓等待
         :return: None
         """
-        picked_account, _ = self.random_exchange_account()
-        hold_time = picked_account.account.hold_time
-        hold_time_deviation = picked_account.account.hold_time_deviation
-        hold_time = hold_time + hold_time * (random.random() * 2 - 1) * hold_time_deviation
-        message = f"任务 [{self.id}] 持仓等待 {hold_time:.2f} 秒"
-        logger.info(message)
+        hold_time = self._hold_time
+        logger.info("任务 [{}] 持仓等待 {:.2f} 秒", self.id, hold_time)
         self.change_stage(stage=RushTaskStage.hold)
         hold_start = now()
         while now() - hold_start < hold_time * 1000:
             await asyncio.sleep(5)
             if self.stop:
-                logger.info(f"任务 [{self.id}] 持仓等待被停止, 直接进入平仓阶段")
+                logger.info("任务 [{}] 持仓等待被停止, 直接进入平仓阶段", self.id)
                 break
         asyncio.create_task(self.close_limit())
 
@@ -356,9 +428,9 @@ class RushTask(BaseModel):
         随机选择一个账户
         :return: 账户
         """
-        picked_account = random.choice([self.first_account, self.second_account])
-        another_account = self.first_account if picked_account == self.second_account else self.second_account
-        return picked_account, another_account
+        if random.getrandbits(1):
+            return self.second_account, self.first_account
+        return self.first_account, self.second_account
 
     async def close_limit(self) -> None:
         """
@@ -371,65 +443,58 @@ class RushTask(BaseModel):
 
         if len(self.filled_orders) != 2:
             raise ValueError(f"任务 [{self.id}] 持仓时间到后执行，挂平仓限价单，但是只有 {len(self.filled_orders)} 个已成交订单")
-        open_buy_orders = [order for order in self.filled_orders if order.hold_type == OrderHoldType.open and order.order_params.side == OrderSide.BUY]
-        if len(open_buy_orders) != 1:
-            raise ValueError(f"任务 [{self.id}] 持仓时间到后执行，挂平仓限价单，但是只有 {len(open_buy_orders)} 个开仓 {OrderSide.BUY.value} 单")
-        open_buy_order = open_buy_orders[0]
-
-        open_sell_orders = [order for order in self.filled_orders if order.hold_type == OrderHoldType.open and order.order_params.side == OrderSide.SELL]
-        if len(open_sell_orders) != 1:
-            raise ValueError(f"任务 [{self.id}] 持仓时间到后执行，挂平仓限价单，但是只有 {len(open_sell_orders)} 个开仓 {OrderSide.SELL.value} 单")
-        open_sell_order = open_sell_orders[0]
+        open_buy_order = self._open_buy_order
+        open_sell_order = self._open_sell_order
+        if open_buy_order is None:
+            raise ValueError(f"任务 [{self.id}] 持仓时间到后执行，挂平仓限价单，但是没有开仓 {OrderSide.BUY.value} 单")
+        if open_sell_order is None:
+            raise ValueError(f"任务 [{self.id}] 持仓时间到后执行，挂平仓限价单，但是没有开仓 {OrderSide.SELL.value} 单")
 
         random_account, _ = self.random_exchange_account()
         # 获取盘口指定位置价格
         position_price: PositionPrice = await random_account.get_depth_position(symbol=self.symbol, position=random_account.account.depth_position)
 
-        close_buy_order_params = OrderParams(
-            symbol=self.symbol,
+        # 两边平仓单使用同一个时间戳和相同的公共参数
+        base_params = dict(symbol=self.symbol, type=OrderType.LIMIT, timeInForce=OrderTimeInForce.GTX, timestamp=now())
+        close_buy_order_params = OrderParams.new_trusted(
+            **base_params,
             side=OrderSide.SELL,
-            type=OrderType.LIMIT,
             price=position_price.ask_price,
             quantity=open_buy_order.order_params.quantity,
-            timeInForce=OrderTimeInForce.GTX,
-            timestamp=now(),
         )
-        close_sell_order_params = OrderParams(
-            symbol=self.symbol,
+        close_sell_order_params = OrderParams.new_trusted(
+            **base_params,
             side=OrderSide.BUY,
-            type=OrderType.LIMIT,
             price=position_price.bid_price,
             quantity=open_sell_order.order_params.quantity,
-            timeInForce=OrderTimeInForce.GTX,
-            timestamp=now(),
         )
 
         # 找到开仓时对应的账户
-        close_buy_order_accounts = [account for account in [self.first_account, self.second_account] if account.account.id == open_buy_order.account_id]
-        if len(close_buy_order_accounts) != 1:
-            raise ValueError(f"任务 [{self.id}] 持仓时间到后执行，挂平仓限价单，但是只有 {len(close_buy_order_accounts)} 个账户")
-        close_buy_order_account = close_buy_order_accounts[0]
-
-        close_sell_order_accounts = [account for account in [self.first_account, self.second_account] if account.account.id == open_sell_order.account_id]
-        if len(close_sell_order_accounts) != 1:
-            raise ValueError(f"任务 [{self.id}] 持仓时间到后执行，挂平仓限价单，但是只有 {len(close_sell_order_accounts)} 个账户")
-        close_sell_order_account = close_sell_order_accounts[0]
-
-        close_buy_task = asyncio.create_task(close_buy_order_account.order(params=close_buy_order_params, hold_type=OrderHoldType.close, price_time=position_price.timestamp))
-        close_sell_task = asyncio.create_task(close_sell_order_account.order(params=close_sell_order_params, hold_type=OrderHoldType.close, price_time=position_price.timestamp))
+        close_buy_order_account = self._account_by_id.get(open_buy_order.account_id)
+        if close_buy_order_account is None:
+            raise ValueError(f"任务 [{self.id}] 持仓时间到后执行，挂平仓限价单，但是找不到账户 {open_buy_order.account_id}")
+
+        close_sell_order_account = self._account_by_id.get(open_sell_order.account_id)
+        if close_sell_order_account is None:
+            raise ValueError(f"任务 [{self.id}] 持仓时间到后执行，挂平仓限价单，但是找不到账户 {open_sell_order.account_id}")
+
         self.change_stage(stage=RushTaskStage.close_limit)
-        results: tuple[Order, Order] = await asyncio.gather(close_buy_task, close_sell_task, return_exceptions=True)
-        for order in results:
-            if isinstance(order, Exception):
-                logger.error(f"任务 [{self.id}] 平仓限价单失败，异常信息：{json.dumps(order, default=str)}")
-                self.failed()
-                return
-            order_id = str(order.order_result["orderId"])
+        # 任意一边下单失败时, TaskGroup 会取消另外一边
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                close_buy_task = task_group.create_task(close_buy_order_account.order(params=close_buy_order_params, hold_type=OrderHoldType.close, price_time=position_price.timestamp))
+                close_sell_task = task_group.create_task(close_sell_order_account.order(params=close_sell_order_params, hold_type=OrderHoldType.close, price_time=position_price.timestamp))
+        except Exception as e:
+            logger.error(f"任务 [{self.id}] 平仓限价单失败，异常信息：{json.dumps(getattr(e, 'exceptions', e), default=str)}")
+            self.failed()
+            return
+        for order in (close_buy_task.result(), close_sell_task.result()):
+            order_id = order.order_id
             self.open_orders[order_id] = order
-            if order_id in self.expired_order_id_map.keys():
-                await self.handle_failed_limit_order(order_id=order_id, message=self.expired_order_id_map[order_id])
-            if order_id in self.filled_order_id_map.keys():
-                self.limit_order_on_filled(order=order, message=self.filled_order_id_map[order_id])
+            if order_id in self._expired_order_id_map:
+                await self.handle_failed_limit_order(order_id=order_id, message=self._expired_order_id_map[order_id])
+            if order_id in self._filled_order_id_map:
+                self.limit_order_on_filled(order=order, message=self._filled_order_id_map[order_id])
 
     async def run(self) -> None:
         """
@@ -438,29 +503,34 @@ class RushTask(BaseModel):
         :return: None
         """
         self.change_status(status=RushTaskStatus.STARTED)
+        # 启动订单更新消息处理任务
+        self._update_task = asyncio.create_task(self.update_worker())
         random_account, another_account = self.random_exchange_account()
         # 获取盘口指定位置价格
         position_price: PositionPrice = await random_account.get_depth_position(symbol=self.symbol, position=random_account.account.depth_position)
 
-        buy_order_params = OrderParams(symbol=self.symbol, side=OrderSide.BUY, type=OrderType.LIMIT, price=position_price.bid_price, timeInForce=OrderTimeInForce.GTX, timestamp=now())
-
-        sell_order_params = OrderParams(symbol=self.symbol, side=OrderSide.SELL, type=OrderType.LIMIT, price=position_price.ask_price, timeInForce=OrderTimeInForce.GTX, timestamp=now())
+        # 两边开仓单使用同一个时间戳和相同的公共参数
+        base_params = dict(symbol=self.symbol, type=OrderType.LIMIT, timeInForce=OrderTimeInForce.GTX, timestamp=now())
+        buy_order_params = OrderParams.new_trusted(**base_params, side=OrderSide.BUY, price=position_price.bid_price)
+        sell_order_params = OrderParams.new_trusted(**base_params, side=OrderSide.SELL, price=position_price.ask_price)
 
-        buy_task = asyncio.create_task(random_account.order(params=buy_order_params, hold_type=OrderHoldType.open, price_time=position_price.timestamp))
-        sell_task = asyncio.create_task(another_account.order(params=sell_order_params, hold_type=OrderHoldType.open, price_time=position_price.timestamp))
         self.change_stage(stage=RushTaskStage.open_limit)
-        results: tuple[Order, Order] = await asyncio.gather(buy_task, sell_task, return_exceptions=True)
-        for order in results:
-            if isinstance(order, Exception):
-                logger.error(f"任务 [{self.id}] 开仓限价单失败，异常信息：{json.dumps(order, default=str)}")
-                self.failed()
-                return
-            order_id = str(order.order_result["orderId"])
+        # 任意一边下单失败时, TaskGroup 会取消另外一边
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                buy_task = task_group.create_task(random_account.order(params=buy_order_params, hold_type=OrderHoldType.open, price_time=position_price.timestamp))
+                sell_task = task_group.create_task(another_account.order(params=sell_order_params, hold_type=OrderHoldType.open, price_time=position_price.timestamp))
+        except Exception as e:
+            logger.error(f"任务 [{self.id}] 开仓限价单失败，异常信息：{json.dumps(getattr(e, 'exceptions', e), default=str)}")
+            self.failed()
+            return
+        for order in (buy_task.result(), sell_task.result()):
+            order_id = order.order_id
             self.open_orders[order_id] = order
-            if order_id in self.expired_order_id_map.keys():
-                await self.handle_failed_limit_order(order_id=order_id, message=self.expired_order_id_map[order_id])
-            if order_id in self.filled_order_id_map.keys():
-                self.limit_order_on_filled(order=order, message=self.filled_order_id_map[order_id])
+            if order_id in self._expired_order_id_map:
+                await self.handle_failed_limit_order(order_id=order_id, message=self._expired_order_id_map[order_id])
+            if order_id in self._filled_order_id_map:
+                self.limit_order_on_filled(order=order, message=self._filled_order_id_map[order_id])
 
     def finish(self) -> None:
         """
@@ -12,8 +12,9 @@ logger.add(
     rotation="00:00", 
     retention="30 days", 
     compression="zip", 
-    encoding="utf-8"
-)  # 每天午夜滚动  # 保留30天  # 压缩历史日志
+    encoding="utf-8",
+    enqueue=True,
+)  # 每天午夜滚动  # 保留30天  # 压缩历史日志  # 日志写入和压缩放到后台线程, 不阻塞事件循环
 
 
 def get_logger(module: str) -> Logger:
@@ -1,4 +1,35 @@
 import time
+from decimal import Decimal, ROUND_DOWN
+from functools import lru_cache
+
+_time_ns = time.time_ns
+
+@lru_cache(maxsize=256)
+def _step_spec(step_size: str) -> tuple[int, Decimal]:
+    """
+    解析stepSize, 返回小数位数和对应的量化精度
+    每个交易对的stepSize固定, 结果缓存后不再重复解析
+    """
+    if '.' in step_size:
+        fraction = step_size.split('.')[1]
+        decimal_part = fraction.rstrip('0')
+        # 如果小数部分全是0，取原始长度
+        decimal_places = len(decimal_part) if decimal_part else len(fraction)
+    else:
+        decimal_places = 0  # 没有小数部分
+    return decimal_places, Decimal(1).scaleb(-decimal_places)
+
+def get_decimal_places(step_size: str) -> int:
+    """
+    获取stepSize对应的小数位数
+
+    Args:
+        step_size: 步长字符串，如"0.00100000"
+
+    Returns:
+        小数位数
+    """
+    return _step_spec(step_size)[0]
 
 def format_to_stepsize(number: float, step_size: str) -> str:
     """
@@ -11,30 +42,14 @@ def format_to_stepsize(number: float, step_size: str) -> str:
     Returns:
         符合步长精度要求的数字字符串
     """
-    # 解析stepSize获取小数位数
-    if '.' in step_size:
-        decimal_part = step_size.split('.')[1].rstrip('0')
-        # 如果小数部分全是0，取原始长度
-        if not decimal_part:
-            decimal_places = len(step_size.split('.')[1])
-        else:
-            decimal_places = len(decimal_part)
-    else:
-        decimal_places = 0  # 没有小数部分
-    
-    # 四舍五入到指定小数位数
-    rounded_number = round(number, decimal_places)
-    
-    # 格式化为指定小数位数的字符串
-    # 确保不会用科学计数法表示
-    format_str = f"%.{decimal_places}f" if decimal_places > 0 else "%d"
-    formatted_str = format_str % rounded_number
-    
-    return formatted_str
+    quant = _step_spec(step_size)[1]
+    # 按精度向下截断, 避免浮点四舍五入后超出持仓或跨过价格档位
+    # 使用 f 格式确保不会用科学计数法表示
+    return f"{Decimal(str(number)).quantize(quant, rounding=ROUND_DOWN):f}"
 
 def now() -> int:
     """
     获取当前时间戳
     :return: 当前时间戳
     """
-    return int(time.time() * 1000)
\ No newline at end of file
+    return _time_ns() // 1_000_000
\ No newline at end of file
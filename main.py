@@ -1,14 +1,60 @@
 import json
 import config
 import asyncio
+import gc
 import signal
 import os
 import httpx
+from typing import Callable
 from lib.logger import get_logger
 from lib.RushEngine import RushEngine
+from exchange.aster.AsterExchange import close_clients
+from exchange.aster.AsterDepthBook import close_depth_books
+
+try:
+    # uvloop 基于 libuv 实现事件循环, 任务调度和网络IO开销更低, 不支持 Windows
+    import uvloop
+except ImportError:
+    uvloop = None
 
 logger = get_logger(__name__)
 
+# 正在发送的 bark 通知任务
+_bark_tasks: set[asyncio.Task] = set()
+# 共享的 bark 通知客户端, 首次发送时创建, 复用连接避免每次重新握手
+_bark_client: httpx.AsyncClient | None = None
+
+def get_bark_client() -> httpx.AsyncClient:
+    global _bark_client
+    if _bark_client is None:
+        _bark_client = httpx.AsyncClient(http2=True, timeout=5.0)
+    return _bark_client
+
+async def close_bark_client():
+    global _bark_client
+    if _bark_client is not None:
+        await _bark_client.aclose()
+        _bark_client = None
+
+# bark 推送内容占位符
+BARK_MESSAGE_PLACEHOLDER = "这里改成你自己的推送内容"
+
+def make_bark_url_builder(url: str | None) -> Callable[[str], str] | None:
+    """
+    根据 bark_url 的格式生成推送地址构造函数, 启动时只判断一次
+    :param url: 配置的 bark_url
+    :return: 传入推送内容返回完整推送地址的函数, 未配置时返回 None
+    """
+    if not url:
+        return None
+    if BARK_MESSAGE_PLACEHOLDER in url:
+        return lambda message: url.replace(BARK_MESSAGE_PLACEHOLDER, message)
+    if url.endswith("/"):
+        return lambda message: url + message
+    return lambda message: f"{url}/{message}"
+
+_bark_url_builder = make_bark_url_builder(config.bark_url)
+
 def check_bark():
     if not config.bark_url:
         logger.error("bark_url 未配置, 无法发送通知")
@@ -21,22 +67,14 @@ def check_bark():
 async def send_bark_async():
     if not check_bark():
         return
-    url = config.bark_url
-    message = "Rushdex 异常退出，请检查。"
-    if "这里改成你自己的推送内容" in url:
-        url = url.replace("这里改成你自己的推送内容", message)
-    elif url.endswith("/"):
-        url += message
+    url = _bark_url_builder("Rushdex 异常退出，请检查。")
+    response = await get_bark_client().get(url)
+    if response.status_code != 200:
+        logger.error(f"发送bark通知失败, 状态码: {response.status_code}, 响应内容: {response.text}")
     else:
-        url += f"/{message}"
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        if response.status_code != 200:
-            logger.error(f"发送bark通知失败, 状态码: {response.status_code}, 响应内容: {response.text}")
-        else:
-            logger.info(f"发送bark通知成功, 响应内容: {response.text}")
-            with open("bark", "w") as f:
-                f.write("bark")
+        logger.info(f"发送bark通知成功, 响应内容: {response.text}")
+        with open("bark", "w") as f:
+            f.write("bark")
 
 def global_exception_handler(loop: asyncio.AbstractEventLoop, context: dict[str, any]) -> None:
     # 1. 先打印完整的异常上下文（asyncio 提供的所有信息），避免遗漏关键信息
@@ -48,8 +86,11 @@ def global_exception_handler(loop: asyncio.AbstractEventLoop, context: dict[str,
 
     # 2. 异步执行 send_bark，避免阻塞事件循环（同步操作会导致循环卡死）
     try:
-        # 使用事件循环创建任务，而非直接 await（处理器是同步函数，不能 await）
-        asyncio.create_task(send_bark_async())
+        # 使用处理器传入的事件循环创建任务，而非直接 await（处理器是同步函数，不能 await）
+        # 保留任务引用，避免通知发送完成前被垃圾回收
+        task = loop.create_task(send_bark_async())
+        _bark_tasks.add(task)
+        task.add_done_callback(_bark_tasks.discard)
     except Exception as e:
         logger.error(f"创建 send_bark 任务失败: {str(e)}", exc_info=True)
 
@@ -60,51 +101,68 @@ def global_exception_handler(loop: asyncio.AbstractEventLoop, context: dict[str,
     except Exception as e:
         logger.error(f"写入 error 文件失败: {str(e)}", exc_info=True)
 
-def check_stop() -> bool:
-    """
-    检查是否需要停止引擎
-    """
-    return os.path.exists("shutdown")
-
 async def main():
+    # 校验配置, 旧版本复制的 config.py 没有 validate_config, 跳过校验
+    validate_config = getattr(config, "validate_config", None)
+    if validate_config is not None:
+        validate_config()
+    # 启动时已经加载的模块, 类和配置对象会一直存活, 先回收一次再冻结,
+    # 之后垃圾回收不再扫描这些对象, 减少运行中 GC 的停顿
+    gc.collect()
+    gc.freeze()
+
+    loop = asyncio.get_running_loop()
+    # 停止事件, 收到终止信号时设置, 当前一轮任务完成后退出
+    stop_event = asyncio.Event()
+    # 当前一轮的引擎
+    rush_engine: RushEngine | None = None
 
-    # 信号处理函数：仅设置标志，不做任何中断操作
-    def handle_signal(signum, frame):
+    # 信号处理函数：仅设置停止标示，不做任何中断操作
+    def handle_signal(signum):
         signal_name = signal.Signals(signum).name
         logger.info(f"收到 {signal_name}，将在当前任务完成后退出")
-        # 软终止标示
-        with open("shutdown", "w") as f:
-            f.write("shutdown")
-        # os.environ["RUSH_ENGINE_SHUTDOWN"] = "1"
+        stop_event.set()
+        # 通过引擎请求停止, 同时唤醒任务运行器, 不用等到下一次超时检查
+        if rush_engine is not None:
+            rush_engine.request_stop()
 
     # 关键：覆盖所有终止信号的默认处理，避免Python触发KeyboardInterrupt
-    signal.signal(signal.SIGINT, handle_signal)  # 处理Ctrl+C
-    signal.signal(signal.SIGTERM, handle_signal)  # 处理kill命令
+    # 处理Ctrl+C和kill命令, 由事件循环在循环内回调, 不在C信号帧中执行
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, handle_signal, signum)
+        except NotImplementedError:
+            # Windows 不支持事件循环信号处理, 退回 signal.signal, 通过 call_soon_threadsafe 回到事件循环中执行
+            signal.signal(signum, lambda signum, frame: loop.call_soon_threadsafe(handle_signal, signum))
 
-    # 启动前清除shutdown文件
-    if os.path.exists("shutdown"):
-        os.remove("shutdown")
     if os.path.exists("error"):
         os.remove("error")
     if os.path.exists("bark"):
         os.remove("bark")
 
-    loop = asyncio.get_running_loop()
     # 设置全局异常处理器
     loop.set_exception_handler(global_exception_handler)
-    while not check_stop():
-        # 创建引擎
-        rush_engine = RushEngine()
-        if config.simulate:
-            logger.info("模拟模式，开启模拟回调")
-            asyncio.create_task(rush_engine.simulate_callback())
-        # 每一轮默认执行100次任务，执行完成后会自动清理账户持仓和订单，防止一些细节问题。
-        # 一轮任务执行时间预估为 100 / 并发数量 * 每个任务的平均执行时间(主要是等待持仓时间)
-        await rush_engine.start(times=100)
-    
+    try:
+        while not stop_event.is_set():
+            # 创建引擎
+            rush_engine = RushEngine()
+            if config.simulate:
+                logger.info("模拟模式，开启模拟回调")
+                asyncio.create_task(rush_engine.simulate_callback())
+            # 每一轮默认执行100次任务，执行完成后会自动清理账户持仓和订单，防止一些细节问题。
+            # 一轮任务执行时间预估为 100 / 并发数量 * 每个任务的平均执行时间(主要是等待持仓时间)
+            await rush_engine.start(times=100, stop_event=stop_event)
+    finally:
+        # 引擎异常退出时也要关闭共享的HTTP客户端和本地盘口
+        await close_clients()
+        await close_depth_books()
+        await close_bark_client()
     logger.info("引擎已停止")
 
 
 if __name__ == "__main__":
     # 主程序不捕获任何异常（确保引擎能完整执行）
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
@@ -14,7 +14,8 @@ class CanceledOrder(Order):
         """
         从订单数据创建已取消订单数据
         """
-        return CanceledOrder(
+        # 数据来自已经校验过的订单, 跳过校验直接构造
+        return CanceledOrder.model_construct(
             **order.__dict__,
             cancel_result=cancel_result,
         )
@@ -1,5 +1,4 @@
 from model.Order import Order
-from model.OrderParams import OrderParams
 
 
 class FilledOrder(Order):
@@ -16,7 +15,8 @@ class FilledOrder(Order):
         """
         从订单数据创建成交订单数据
         """
-        return FilledOrder(
+        # 数据来自已经校验过的订单, 跳过校验直接构造
+        return FilledOrder.model_construct(
             **order.__dict__,
             filled_result=filled_result,
         )
@@ -29,3 +29,28 @@ class Order(BaseModel):
     order_result: dict | None = None
     # 账户id
     account_id: str
+    # 订单id, 由 order_result 中的 orderId 转换而来
+    order_id: str | None = None
+
+    def model_post_init(self, __context) -> None:
+        if self.order_id is None and self.order_result is not None and "orderId" in self.order_result:
+            self.order_id = str(self.order_result["orderId"])
+
+    @classmethod
+    def new_trusted(cls, *, price_time: int, hold_type: OrderHoldType, order_params: OrderParams, order_result: dict | None, account_id: str) -> "Order":
+        """
+        创建内部生成的订单, 字段都来自可信代码, 跳过校验直接构造
+        :param price_time: 价格时间
+        :param hold_type: 持仓目的类型
+        :param order_params: 下单原始数据
+        :param order_result: 下单结果数据
+        :param account_id: 账户id
+        :return: 订单
+        """
+        return cls.model_construct(
+            price_time=price_time,
+            hold_type=hold_type,
+            order_params=order_params,
+            order_result=order_result,
+            account_id=account_id,
+        )
@@ -1,6 +1,4 @@
-from abc import ABC
 from enum import Enum
-from typing import Literal
 from pydantic import BaseModel
 
 
@@ -29,3 +27,33 @@ class OrderParams(BaseModel):
     price: str | None = None
     quantity: str | None = None
     timeInForce: OrderTimeInForce | None = None
+
+    @classmethod
+    def new_trusted(cls, *, symbol: str, side: OrderSide, type: OrderType, timestamp: int, price: str | None = None, quantity: str | None = None, timeInForce: OrderTimeInForce | None = None) -> "OrderParams":
+        """
+        创建内部生成的下单参数, 字段都来自可信代码, 跳过校验直接构造
+        :return: 下单参数
+        """
+        return cls.model_construct(
+            symbol=symbol,
+            side=side,
+            type=type,
+            timestamp=timestamp,
+            price=price,
+            quantity=quantity,
+            timeInForce=timeInForce,
+        )
+
+    def to_market_params(self, *, timestamp: int) -> "OrderParams":
+        """
+        生成同方向, 同数量的市价单参数
+        :param timestamp: 下单时间戳
+        :return: 市价单参数
+        """
+        return OrderParams.new_trusted(
+            symbol=self.symbol,
+            side=self.side,
+            type=OrderType.MARKET,
+            timestamp=timestamp,
+            quantity=self.quantity,
+        )
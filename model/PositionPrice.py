@@ -1,8 +1,10 @@
-from pydantic import BaseModel
+from dataclasses import dataclass
 
-class PositionPrice(BaseModel): 
+@dataclass(slots=True, frozen=True)
+class PositionPrice: 
     """
     盘口指定位置价格数据类
+    只在下单前内部生成和读取, 不需要校验和序列化, 使用 slots dataclass 减少创建开销
     """
     ask_price: str
     bid_price: str
@@ -1,10 +1,46 @@
-from pydantic import BaseModel
+import math
+from dataclasses import dataclass, field
+from lib.tools import get_decimal_places
 
 
-class Symbol(BaseModel):
+@dataclass(slots=True)
+class Symbol:
     """
     交易对数据类
+    由交易所信息内部生成, 不需要校验和序列化, 使用 slots dataclass 减少内存和属性访问开销
     """
     symbol: str
     tick_size: str | None = None
     step_size: str | None = None
+    # 以下字段在创建时由 tick_size, step_size 计算, 避免下单时重复转换
+    # tick_size, step_size 对应的浮点数
+    tick_size_f: float | None = field(default=None, init=False)
+    step_size_f: float | None = field(default=None, init=False)
+    # step_size 的小数位数
+    step_decimals: int | None = field(default=None, init=False)
+    # 数量的整数缩放倍数(10 ** step_decimals), 以及 step_size 缩放后的整数值
+    qty_scale: int | None = field(default=None, init=False)
+    step_units: int | None = field(default=None, init=False)
+
+    def __post_init__(self) -> None:
+        if self.tick_size is not None:
+            self.tick_size_f = float(self.tick_size)
+        if self.step_size is not None:
+            self.step_size_f = float(self.step_size)
+            self.step_decimals = get_decimal_places(self.step_size)
+            self.qty_scale = 10 ** self.step_decimals
+            self.step_units = round(self.step_size_f * self.qty_scale)
+
+    def format_quantity(self, quantity: float) -> str:
+        """
+        按 step_size 向下取整并格式化下单数量
+        :param quantity: 下单数量
+        :return: 符合 step_size 精度的数量字符串
+        """
+        # 加上极小值, 避免 0.3 / 0.1 = 2.9999999999999996 这类浮点误差被向下取整
+        steps = math.floor(quantity / self.step_size_f + 1e-9)
+        # 用缩放后的整数计算数量, 再拆成整数和小数部分拼接, 不经过浮点乘法和格式化
+        integer_part, fraction_part = divmod(steps * self.step_units, self.qty_scale)
+        if self.step_decimals == 0:
+            return str(integer_part)
+        return f"{integer_part}.{fraction_part:0{self.step_decimals}d}"